@@ -2,20 +2,65 @@
 import json
 import time
 import os
-from concurrent.futures import ProcessPoolExecutor
-
-# Must be at module level for ProcessPoolExecutor
-def get_container_metrics(vm_host, container_name):
-    import subprocess
-    import json
-    import time
-    KEY_PATH = "/home/bngl1/projects/cs5939/Cloud Monitoring Service/key_school_vm.pem"
-    remote_cmd = f"docker stats {container_name} --no-stream --format '{{{{json .}}}}'"
-    ssh_cmd = ["ssh", "-i", KEY_PATH, "-o", "StrictHostKeyChecking=no", vm_host, remote_cmd]
-    result = subprocess.run(ssh_cmd, capture_output=True, text=True, timeout=10)
-    if result.returncode != 0:
-        raise RuntimeError(f"SSH/docker failed for {vm_host}:{container_name}: {result.stderr.strip()}")
-    raw = json.loads(result.stdout.strip())
+import re
+import subprocess
+import threading
+import urllib.request
+from collections import defaultdict
+
+from metrics_store import MetricsStore
+
+# Configuration
+KEY_PATH = "/home/bngl1/projects/cs5939/Cloud Monitoring Service/key_school_vm.pem"
+
+# One multiplexed SSH master connection is kept per VM and reused by every
+# command sent to it (stats stream, reconnects, log tailing)
+SSH_CONTROL_DIR = os.path.expanduser("~/.ssh/cloud-monitoring")
+
+TARGETS = [
+    ("bngl1@cs5939-vm01.st-andrews.ac.uk", "face-extract-api"),
+    ("bngl1@cs5939-vm02.st-andrews.ac.uk", "face-encode-api"),
+    ("bngl1@cs5939-vm02.st-andrews.ac.uk", "face-analysis-api"),
+]
+
+# The collector and dashboard run on this VM, so its services are reached on localhost
+LOCAL_VM = "bngl1@cs5939-vm01.st-andrews.ac.uk"
+
+# Published port of each service, scraped at /metrics for per-stage timings
+SERVICE_PORTS = {
+    "face-extract-api": 8000,
+    "face-encode-api": 8001,
+    "face-analysis-api": 8002,
+}
+
+SAMPLE_INTERVAL = 0.5        # seconds between writes to the metrics store
+STATS_INTERVAL = 1           # seconds between refreshes of the streamed stats (podman defaults to 5)
+STALE_AFTER = 3.0 * STATS_INTERVAL  # no new sample for this long -> data is flagged stale
+RECONNECT_AFTER = 15.0       # silent stream for this long -> kill it and reconnect
+RECONNECT_BACKOFF_MAX = 30.0
+STAGE_SCRAPE_INTERVAL = 2.0  # seconds between /metrics scrapes
+
+STAGE_SAMPLE_RE = re.compile(r'^face_pipeline_stage_seconds_(sum|count)\{([^}]*)\}\s+(\S+)')
+LABEL_RE = re.compile(r'(\w+)="([^"]*)"')
+
+
+def ssh_command(vm_host, remote_cmd):
+    """Build an ssh command that shares one persistent connection per VM."""
+    os.makedirs(SSH_CONTROL_DIR, mode=0o700, exist_ok=True)
+    return [
+        "ssh", "-i", KEY_PATH,
+        "-o", "StrictHostKeyChecking=no",
+        "-o", "ControlMaster=auto",
+        "-o", f"ControlPath={SSH_CONTROL_DIR}/%C",
+        "-o", "ControlPersist=10m",
+        "-o", "ServerAliveInterval=5",
+        "-o", "ServerAliveCountMax=3",
+        vm_host, remote_cmd,
+    ]
+
+
+def parse_container_stats(raw, container_name, received_at):
+    """Convert one `docker stats --format '{{json .}}'` record to a log entry."""
     mem_usage = raw.get("MemUsage", 0)
     mem_limit = raw.get("MemLimit", 1)
     mem_pct = raw.get("MemPerc")
@@ -24,7 +69,7 @@ def get_container_metrics(vm_host, container_name):
     net_interfaces = raw.get("Network", {})
     first_iface_stats = next(iter(net_interfaces.values()), {})
     return {
-        "timestamp": time.time(),
+        "timestamp": received_at,
         "container_name": raw.get("Name", container_name),
         "cpu_percent": float(raw.get("CPU", 0.0)),
         "memory_usage_bytes": int(mem_usage),
@@ -35,80 +80,258 @@ def get_container_metrics(vm_host, container_name):
         "uptime_seconds": float(raw.get("Duration", 0)) / 1e9,
     }
 
-# Configuration
-TARGETS = [
-    ("bngl1@cs5939-vm01.st-andrews.ac.uk", "face-extract-api"),
-    ("bngl1@cs5939-vm02.st-andrews.ac.uk", "face-encode-api"),
-    ("bngl1@cs5939-vm02.st-andrews.ac.uk", "face-analysis-api"),
-]
 
-LOG_FILE = "container_logs.json"
+class VMStatsStream:
+    """Streaming `docker stats` for all containers of one VM over a single SSH session.
+
+    A background thread parses the stream line by line and keeps only the
+    latest sample per watched container, so a container that is missing only
+    goes stale on its own. If the stream exits or goes silent it is
+    restarted with exponential backoff.
+    """
+
+    def __init__(self, vm_host, container_names):
+        self.vm_host = vm_host
+        self.container_names = list(container_names)
+        self.started_at = time.time()
+        self._latest = {}
+        self._lock = threading.Lock()
+        self._proc = None
+        self._last_line_at = time.time()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name=f"stats-{vm_host}", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._kill()
 
-def load_logs():
-    if os.path.exists(LOG_FILE):
-        with open(LOG_FILE, "r") as f:
-            return json.load(f)
-    else:
-        return {
-            "face-extract-api": [],
-            "face-encode-api": [],
-            "face-analysis-api": []
-        }
+    def _kill(self):
+        proc = self._proc
+        if proc is not None and proc.poll() is None:
+            proc.kill()
+
+    def _run(self):
+        # No container names: a missing container (e.g. mid-redeploy) would fail
+        # the whole command; records for other containers are dropped on arrival
+        remote_cmd = f"docker stats --interval {STATS_INTERVAL} --format '{{{{json .}}}}'"
+        backoff = 1.0
+        while not self._stop.is_set():
+            connected_at = time.time()
+            try:
+                self._last_line_at = connected_at
+                self._proc = subprocess.Popen(
+                    ssh_command(self.vm_host, remote_cmd),
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    text=True,
+                    bufsize=1,
+                )
+                for line in self._proc.stdout:
+                    self._handle_line(line)
+                returncode = self._proc.wait()
+                if not self._stop.is_set():
+                    print(f"⚠️ Stats stream for {self.vm_host} exited ({returncode}), reconnecting", flush=True)
+            except Exception as e:
+                print(f"Error: stats stream for {self.vm_host}: {e}", flush=True)
+
+            # A connection that stayed up for a while resets the backoff
+            if time.time() - connected_at > 60:
+                backoff = 1.0
+            self._stop.wait(backoff)
+            backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+
+    def _handle_line(self, line):
+        received_at = time.time()
+        self._last_line_at = received_at
+
+        # `docker stats` prefixes every refresh with terminal control codes
+        start = line.find("{")
+        if start < 0:
+            if line.strip():
+                print(f"⚠️ {self.vm_host}: {line.strip()}", flush=True)
+            return
+        try:
+            raw = json.loads(line[start:])
+        except ValueError:
+            return
+
+        # A malformed record must not take down the stream of every container
+        try:
+            sample = parse_container_stats(raw, raw.get("Name", ""), received_at)
+        except (AttributeError, TypeError, ValueError) as e:
+            print(f"⚠️ {self.vm_host}: skipping unparseable stats record ({e}): {line.strip()[:200]}", flush=True)
+            return
+        if sample["container_name"] not in self.container_names:
+            return
+        with self._lock:
+            self._latest[sample["container_name"]] = sample
+
+    def check_alive(self, now):
+        """Force a reconnect if the stream is running but has gone silent."""
+        if now - self._last_line_at > RECONNECT_AFTER:
+            print(f"⚠️ No stats from {self.vm_host} for {RECONNECT_AFTER:.0f}s, reconnecting", flush=True)
+            self._last_line_at = now
+            self._kill()
+
+    def snapshot(self, now):
+        """Return (container_name, latest_sample_or_None, is_stale) per container."""
+        with self._lock:
+            latest = dict(self._latest)
+        result = []
+        for name in self.container_names:
+            sample = latest.get(name)
+            last_seen = sample["timestamp"] if sample else self.started_at
+            result.append((name, sample, now - last_seen > STALE_AFTER))
+        return result
+
+
+def service_metrics_urls(targets, local_vm=LOCAL_VM):
+    """/metrics URL per service, built from the TARGETS hostnames.
+
+    Each can be overridden with an env var named after the container, e.g.
+    FACE_ENCODE_API_METRICS_URL.
+    """
+    urls = {}
+    for vm_host, container_name in targets:
+        port = SERVICE_PORTS.get(container_name)
+        if port is None:
+            continue
+        host = "localhost" if vm_host == local_vm else vm_host.rsplit("@", 1)[-1]
+        env_name = f"{container_name.upper().replace('-', '_')}_METRICS_URL"
+        urls[container_name] = os.getenv(env_name, f"http://{host}:{port}/metrics")
+    return urls
+
+
+def parse_stage_totals(text):
+    """Cumulative {stage: [sum_seconds, count]} from a service's Prometheus text."""
+    totals = defaultdict(lambda: [0.0, 0.0])
+    for line in text.splitlines():
+        match = STAGE_SAMPLE_RE.match(line)
+        if not match:
+            continue
+        kind, labels, value = match.groups()
+        stage = dict(LABEL_RE.findall(labels)).get("stage")
+        if stage:
+            totals[stage][0 if kind == "sum" else 1] = float(value)
+    return dict(totals)
+
+
+class StageTimingScraper:
+    """Polls each service's /metrics and turns histogram totals into
+    per-interval mean latencies, ready to be stored next to CPU and RAM."""
+
+    def __init__(self, urls, interval=STAGE_SCRAPE_INTERVAL):
+        self.urls = dict(urls)
+        self.interval = interval
+        self._previous = {}
+        self._pending = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stage-scraper", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            for container_name, url in self.urls.items():
+                try:
+                    with urllib.request.urlopen(url, timeout=self.interval) as response:
+                        text = response.read().decode()
+                except Exception:
+                    continue  # service down; its CPU/RAM staleness is reported already
+                self._record(container_name, parse_stage_totals(text), time.time())
+
+    def _record(self, container_name, totals, now):
+        previous = self._previous.get(container_name)
+        self._previous[container_name] = totals
+        if previous is None:
+            return  # first scrape only sets the baseline
+        rows = []
+        for stage, (total_sum, total_count) in totals.items():
+            prev_sum, prev_count = previous.get(stage, (0.0, 0.0))
+            if total_count < prev_count:  # service restarted, counters reset
+                prev_sum, prev_count = 0.0, 0.0
+            count = total_count - prev_count
+            if count > 0:
+                rows.append({
+                    "container_name": container_name,
+                    "stage": stage,
+                    "timestamp": now,
+                    "count": int(count),
+                    "mean_seconds": (total_sum - prev_sum) / count,
+                })
+        if rows:
+            with self._lock:
+                self._pending.extend(rows)
+
+    def drain(self):
+        with self._lock:
+            rows, self._pending = self._pending, []
+        return rows
+
+
+def start_streams(targets):
+    containers_by_vm = defaultdict(list)
+    for vm_host, container_name in targets:
+        containers_by_vm[vm_host].append(container_name)
+    return [
+        VMStatsStream(vm_host, names).start()
+        for vm_host, names in containers_by_vm.items()
+    ]
 
-def save_logs(logs):
-    with open(LOG_FILE, "w") as f:
-        json.dump(logs, f, indent=2)
 
 def main():
+    store = MetricsStore()
+    streams = start_streams(TARGETS)
+    scraper = StageTimingScraper(service_metrics_urls(TARGETS)).start()
+    last_written = {}
+    stale = {}
+
     try:
         while True:
             start = time.time()
-            
-            # Fetch all metrics in parallel
-            with ProcessPoolExecutor() as executor:
-                futures = [
-                    executor.submit(get_container_metrics, vm_host, container_name)
-                    for vm_host, container_name in TARGETS
-                ]
-                results = []
-                for future in futures:
-                    try:
-                        results.append(future.result())
-                    except Exception as e:
-                        print(f"Error: {e}", flush=True)
-
-            # Load current logs
-            logs = load_logs()
-            
-            # Append each result to its container list
-            for res in results:
-                cname = res["container_name"]
-                if cname in logs:
-                    logs[cname].append(res)
-                else:
-                    print(f"Warning: Unexpected container {cname}", flush=True)
-            
-            # --- NEW: Filter logs to keep only last 2 minutes ---
-            current_time = time.time()
-            two_minutes_ago = current_time - 90  # 2 minutes = 120 seconds
-
-            for container_name in logs:
-                # Keep only entries newer than 2 minutes ago
-                logs[container_name] = [
-                    entry for entry in logs[container_name]
-                    if entry.get("timestamp", 0) >= two_minutes_ago
-                ]
-
-            # Save back to file
-            save_logs(logs)
-            
-            # Maintain ~0.5s interval (you had 2s, but comment says 0.5s — adjust as needed)
+
+            # Collect the newest sample per container; streams run in the background
+            results = []
+            for stream in streams:
+                stream.check_alive(start)
+                for cname, sample, is_stale in stream.snapshot(start):
+                    if is_stale != stale.get(cname, False):
+                        if is_stale:
+                            print(f"⚠️ Metrics for {cname} are stale (> {STALE_AFTER:.0f}s old)", flush=True)
+                        else:
+                            print(f"✅ Metrics for {cname} are fresh again", flush=True)
+                        stale[cname] = is_stale
+                    if sample is not None and sample["timestamp"] > last_written.get(cname, 0):
+                        results.append(sample)
+                        last_written[cname] = sample["timestamp"]
+
+            # Append in one transaction; old samples are pruned by the store
+            store.append_many(results)
+            store.append_stage_timings(scraper.drain())
+
             elapsed = time.time() - start
-            sleep_time = max(0, 0.5 - elapsed)  # Changed from 2 to 0.5 as per your comment
+            sleep_time = max(0, SAMPLE_INTERVAL - elapsed)
             time.sleep(sleep_time)
-            
+
     except KeyboardInterrupt:
         print("\nMonitoring stopped.")
+    finally:
+        for stream in streams:
+            stream.stop()
+        scraper.stop()
+        store.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,46 +1,33 @@
 import dash
-from dash import dcc, html, Input, Output
+from dash import dcc, html, Input, Output, State, ctx, no_update
 import dash_bootstrap_components as dbc
-import plotly.express as px
-import pandas as pd
-import json
+import plotly.graph_objects as go
 import time
-import os
-import subprocess
-import re
+
+from cloud_logging import STAGE_SCRAPE_INTERVAL, STALE_AFTER, STATS_INTERVAL, TARGETS
+from log_tailer import start_log_tailers
+from metrics_store import MetricsStore
+from series_cache import SeriesCache, WINDOWS, sample_values
 
 # --- CONFIGURATION ---
-JSON_FILE_PATH = '/home/bngl1/projects/cs5939/Cloud Monitoring Service/container_logs.json'
+metrics_store = MetricsStore()
 
 CONTAINER_LIST = [
     "face-extract-api",
     "face-analysis-api",
     "face-encode-api"
 ]
-# ---------------------
 
-# ========== DOCKER LOG FUNCTION (added only this) ==========
-def get_recent_docker_logs_simple(container_name, time_ago="1m"):
-    try:
-        result = subprocess.run(
-            ['docker', 'logs', '--since', time_ago, container_name],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        logs = result.stdout
-
-        filtered = []
-        for line in logs.splitlines():
-            if "GET /metrics" in line:
-                continue
-            filtered.append(line)
-        return "\n".join(filtered)
-
-    except Exception as e:
-        return f"Error: {e}"
-# ============================================================
+CONTAINER_COLORS = ["#1f77b4", "#d62728", "#2ca02c", "#ff7f0e", "#9467bd", "#8c564b"]
 
+LOG_WINDOW_SECONDS = 60
+LOG_SEARCH_LIMIT = 500  # lines shown when searching the whole buffer
+# ---------------------
+
+series_cache = SeriesCache(metrics_store, CONTAINER_LIST)
+log_tailers = start_log_tailers(
+    [(vm_host, name) for vm_host, name in TARGETS if name in CONTAINER_LIST]
+)
 
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 
@@ -56,7 +43,7 @@ app.layout = dbc.Container([
     # Dropdown
     dbc.Row([
         dbc.Col([
-            html.Label("Select Container:", className="fw-bold"),
+            html.Label("Select Container (metrics & logs):", className="fw-bold"),
             dcc.Dropdown(
                 id="container-dropdown",
                 options=[{"label": c, "value": c} for c in CONTAINER_LIST],
@@ -93,6 +80,13 @@ app.layout = dbc.Container([
         # RIGHT 6 COL: LOG PANEL
         dbc.Col([
             html.H4("Recent Logs (Last 60 sec)", className="mt-4 mb-2"),
+            dbc.Input(
+                id="log-search",
+                type="search",
+                placeholder="Search all buffered logs...",
+                debounce=True,
+                className="mb-2"
+            ),
             html.Pre(
                 id="log-output",
                 style={
@@ -111,8 +105,20 @@ app.layout = dbc.Container([
     ]),
 
     # ---------------------------------------------------
-    # ROW 2 — TWO CHARTS (unchanged)
+    # ROW 2 — TWO CHARTS (all containers, selectable window)
     # ---------------------------------------------------
+    dbc.Row([
+        dbc.Col([
+            dbc.RadioItems(
+                id="window-selector",
+                options=[{"label": w["label"], "value": key} for key, w in WINDOWS.items()],
+                value="1m",
+                inline=True,
+                className="mt-3"
+            )
+        ], width=12)
+    ]),
+
     dbc.Row([
         dbc.Col([dcc.Graph(id='ram-percent-chart', config={'displayModeBar': False})],
                 width=6, className="p-2"),
@@ -121,107 +127,229 @@ app.layout = dbc.Container([
                 width=6, className="p-2")
     ], className="g-3"),
 
+    # ---------------------------------------------------
+    # ROW 3 — PIPELINE STAGE LATENCY (selected container)
+    # ---------------------------------------------------
+    dbc.Row([
+        dbc.Col([dcc.Graph(id='stage-latency-chart', config={'displayModeBar': False})],
+                width=12, className="p-2")
+    ], className="g-3"),
+
+    # Per-browser position of the last points sent to the charts
+    dcc.Store(id='chart-cursor'),
+
     dcc.Interval(id='interval-component', interval=2000, n_intervals=0)
 
 ], fluid=True, className="bg-light p-4")
 
 
 # ============================================================
-# CALLBACK (only *1 line added*: Output('log-output','children')
+# CHART HELPERS
+# ============================================================
+CHART_METRICS = {
+    "mem": {"title": "RAM Usage (%)"},
+    "cpu": {"title": "CPU Usage (%)"},
+}
+
+
+def collect_points(window_key, after):
+    """New chart points per container since the cursor `after` (container -> ts).
+
+    Returns {container: {"x": [...], "cpu": {...}, "mem": {...}}} where each
+    metric holds "mean" (raw values for the live window) and, for bucketed
+    windows, "min"/"max" as well, plus the updated cursor.
+    """
+    window = WINDOWS[window_key]
+    points = {}
+    cursor = dict(after)
+    for c in CONTAINER_LIST:
+        since = after.get(c, 0)
+        data = {"x": [], "cpu": {"mean": [], "min": [], "max": []},
+                "mem": {"mean": [], "min": [], "max": []}}
+        if window["bucket"] is None:
+            for ts, cpu, mem in series_cache.raw_points(c, since):
+                data["x"].append(ts * 1000)
+                data["cpu"]["mean"].append(cpu)
+                data["mem"]["mean"].append(mem)
+                cursor[c] = ts
+        else:
+            half = window["bucket"] / 2
+            for start, bucket in series_cache.bucket_points(c, window_key, since):
+                data["x"].append((start + half) * 1000)
+                for metric in ("cpu", "mem"):
+                    data[metric]["mean"].append(bucket[f"{metric}_sum"] / bucket["count"])
+                    data[metric]["min"].append(bucket[f"{metric}_min"])
+                    data[metric]["max"].append(bucket[f"{metric}_max"])
+                cursor[c] = start
+        points[c] = data
+    return points, cursor
+
+
+def trace_columns(window_key, points, metric):
+    """(x, y) for every trace of a chart, in trace order.
+
+    The live window has one line per container; bucketed windows have a
+    max line, a min line filled up to it, and the mean line.
+    """
+    columns = []
+    for c in CONTAINER_LIST:
+        data = points[c]
+        if WINDOWS[window_key]["bucket"] is None:
+            columns.append((data["x"], data[metric]["mean"]))
+        else:
+            columns.append((data["x"], data[metric]["max"]))
+            columns.append((data["x"], data[metric]["min"]))
+            columns.append((data["x"], data[metric]["mean"]))
+    return columns
+
+
+def max_points(window_key):
+    window = WINDOWS[window_key]
+    if window["bucket"] is None:
+        return int(window["seconds"] / STATS_INTERVAL)  # one sample per stats refresh
+    return int(window["seconds"] / window["bucket"])
+
+
+def build_figure(window_key, points, metric):
+    bucketed = WINDOWS[window_key]["bucket"] is not None
+    columns = iter(trace_columns(window_key, points, metric))
+    fig = go.Figure()
+    for i, c in enumerate(CONTAINER_LIST):
+        color = CONTAINER_COLORS[i % len(CONTAINER_COLORS)]
+        if bucketed:
+            x, y = next(columns)
+            fig.add_trace(go.Scatter(x=x, y=y, mode="lines", line_width=0,
+                                     line_color=color, legendgroup=c,
+                                     showlegend=False, hoverinfo="skip"))
+            x, y = next(columns)
+            fig.add_trace(go.Scatter(x=x, y=y, mode="lines", line_width=0,
+                                     line_color=color, fill="tonexty", opacity=0.2,
+                                     legendgroup=c, showlegend=False, hoverinfo="skip"))
+        x, y = next(columns)
+        fig.add_trace(go.Scatter(x=x, y=y, mode="lines", name=c,
+                                 line_color=color, legendgroup=c))
+
+    title = CHART_METRICS[metric]["title"]
+    fig.update_layout(
+        title=f"{title.split(' (')[0]}: last {WINDOWS[window_key]['label']}",
+        xaxis_title="Time", yaxis_title=title, xaxis_type="date",
+        template="plotly_white", hovermode="x unified",
+        legend_orientation="h", uirevision=window_key
+    )
+    return fig
+
+
+def extend_data(window_key, points, metric):
+    columns = trace_columns(window_key, points, metric)
+    if not any(x for x, _ in columns):
+        return no_update
+    return (
+        {"x": [x for x, _ in columns], "y": [y for _, y in columns]},
+        list(range(len(columns))),
+        max_points(window_key),
+    )
+
+
+# ============================================================
+# CALLBACKS
 # ============================================================
 @app.callback(
     [
         Output('ram-percent-chart', 'figure'),
+        Output('ram-percent-chart', 'extendData'),
         Output('cpu-percent-chart', 'figure'),
+        Output('cpu-percent-chart', 'extendData'),
+        Output('chart-cursor', 'data')
+    ],
+    [Input('interval-component', 'n_intervals'),
+     Input('window-selector', 'value')],
+    [State('chart-cursor', 'data')]
+)
+def update_charts(n, window_key, cursor):
+    series_cache.refresh()
+
+    # Full figures only on first load or window change; afterwards only new points
+    if cursor is None or ctx.triggered_id == 'window-selector' or cursor.get("window") != window_key:
+        points, after = collect_points(window_key, {})
+        return (build_figure(window_key, points, "mem"), no_update,
+                build_figure(window_key, points, "cpu"), no_update,
+                {"window": window_key, "after": after})
+
+    points, after = collect_points(window_key, cursor["after"])
+    return (no_update, extend_data(window_key, points, "mem"),
+            no_update, extend_data(window_key, points, "cpu"),
+            {"window": window_key, "after": after})
+
+
+@app.callback(
+    [
         Output('log-output', 'children'),
-        Output('latest-metrics', 'children')  # NEW
+        Output('latest-metrics', 'children')
     ],
     [Input('interval-component', 'n_intervals'),
-     Input('container-dropdown', 'value')]
+     Input('container-dropdown', 'value'),
+     Input('log-search', 'value')]
 )
+def update_details(n, selected_container, search):
+
+    # Logs for the SELECTED container come from its background tailer
+    tailer = log_tailers.get(selected_container)
+    if tailer is None:
+        logs = f"No log tailer for {selected_container}"
+    elif search:
+        logs = "\n".join(tailer.lines(search=search, limit=LOG_SEARCH_LIMIT))
+    else:
+        logs = "\n".join(tailer.lines(since=time.time() - LOG_WINDOW_SECONDS))
+
+    series_cache.refresh()
+    latest = series_cache.latest(selected_container)
+    if latest is None:
+        return logs, "No metric data"
+
+    age = time.time() - latest["timestamp"]
+    # NULL or zero limits are stored as-is; sample_values copes with them
+    cpu_percent, memory_percent = sample_values(latest)
+    latest_metrics_str = (
+        f"Last sample: {age:.1f}s ago{' (STALE)' if age > STALE_AFTER else ''}\n"
+        f"Uptime (min): {latest['uptime_seconds']}\n"
+        f"CPU %: {cpu_percent:.2f}\n"
+        f"RAM %: {memory_percent:.2f}\n"
+        f"Memory Usage: {(latest['memory_usage_bytes'] or 0) / (1024**2):.1f} MB\n"
+        f"Memory Limit: {(latest['memory_limit_bytes'] or 0) / (1024**2):.1f} MB"
+    )
+    return logs, latest_metrics_str
 
-def update_graphs(n, selected_container):
-
-    # Fetch logs for the SELECTED container (not hardcoded!)
-    logs = get_recent_docker_logs_simple(selected_container, "1m")
-
-    empty_fig = px.line(title="No data available")
-    empty_fig.update_layout(template="plotly_white")
-
-    # Default for latest metrics
-    latest_metrics_str = "No metric data"
-
-    if not os.path.exists(JSON_FILE_PATH):
-        return empty_fig, empty_fig, logs, latest_metrics_str  # ✅ 4 items
-
-    try:
-        with open(JSON_FILE_PATH, 'r') as f:
-            data = json.load(f)
-
-        container_logs = data.get(selected_container, [])
-
-        if not container_logs:
-            return empty_fig, empty_fig, logs, latest_metrics_str  # ✅
-
-        df = pd.DataFrame(container_logs)
-
-        required_columns = ['timestamp', 'memory_usage_bytes',
-                            'memory_limit_bytes', 'cpu_percent']
-        if not all(col in df.columns for col in required_columns):
-            return empty_fig, empty_fig, logs, latest_metrics_str  # ✅
-
-        df["datetime"] = pd.to_datetime(df["timestamp"], unit="s")
-        df["memory_percent"] = (df["memory_usage_bytes"] / df["memory_limit_bytes"]) * 100
-
-        now = time.time()
-        df = df[df["timestamp"] > now - 60]
-
-        if df.empty:
-            ram_empty = px.line(title="No RAM data").update_layout(template="plotly_white")
-            cpu_empty = px.line(title="No CPU data").update_layout(template="plotly_white")
-            return ram_empty, cpu_empty, logs, latest_metrics_str  # ✅
-
-        # Get latest metric entry for display
-        latest_row = df.iloc[-1]
-        latest_metrics_str = (
-            f"Uptime (min): {latest_row['uptime_seconds']}\n"
-            f"CPU %: {latest_row['cpu_percent']:.2f}\n"
-            f"RAM %: {latest_row['memory_percent']:.2f}\n"
-            f"Memory Usage: {latest_row['memory_usage_bytes'] / (1024**2):.1f} MB\n"
-            f"Memory Limit: {latest_row['memory_limit_bytes'] / (1024**2):.1f} MB"
-        )
-
-        # RAM chart
-        ram_fig = px.line(
-            df, x="datetime", y="memory_percent",
-            title=f"RAM Usage: {selected_container}",
-            markers=True, line_shape='linear'
-        )
-        ram_fig.update_traces(line_color='blue')
-        ram_fig.update_layout(
-            xaxis_title="Time", yaxis_title="RAM Usage (%)",
-            yaxis_range=[max(0, df["memory_percent"].min() - 2), df["memory_percent"].max() + 2],
-            template="plotly_white", hovermode="x unified"
-        )
-
-        # CPU chart
-        cpu_fig = px.line(
-            df, x="datetime", y="cpu_percent",
-            title=f"CPU Usage: {selected_container}",
-            markers=True, line_shape='linear'
-        )
-        cpu_fig.update_traces(line_color='red')
-        cpu_fig.update_layout(
-            xaxis_title="Time", yaxis_title="CPU Usage (%)",
-            yaxis_range=[max(0, df["cpu_percent"].min() - 0.3), df["cpu_percent"].max() + 0.3],
-            template="plotly_white", hovermode="x unified"
-        )
-
-        return ram_fig, cpu_fig, logs, latest_metrics_str  # ✅ 4 items
-
-    except Exception as e:
-        print("Error:", e)
-        return empty_fig, empty_fig, logs, f"Error: {str(e)}"  # ✅
+
+@app.callback(
+    Output('stage-latency-chart', 'figure'),
+    [Input('interval-component', 'n_intervals'),
+     Input('container-dropdown', 'value'),
+     Input('window-selector', 'value')]
+)
+def update_stage_latency(n, selected_container, window_key):
+    # Stage timings come from the services' /metrics, scraped by cloud_logging.py
+    window = WINDOWS[window_key]
+    bucket_seconds = window["bucket"] or STAGE_SCRAPE_INTERVAL
+    rows = metrics_store.stage_timings(
+        selected_container, time.time() - window["seconds"], bucket_seconds
+    )
+
+    fig = go.Figure()
+    stages = {}
+    for row in rows:
+        x, y = stages.setdefault(row["stage"], ([], []))
+        x.append((row["bucket"] + bucket_seconds / 2) * 1000)
+        y.append(row["mean_seconds"] * 1000)
+    for stage, (x, y) in stages.items():
+        fig.add_trace(go.Scatter(x=x, y=y, mode="lines+markers", name=stage))
+
+    fig.update_layout(
+        title=f"Stage Latency: {selected_container}" + ("" if stages else " (no data)"),
+        xaxis_title="Time", yaxis_title="Mean latency (ms)", xaxis_type="date",
+        template="plotly_white", hovermode="x unified",
+        uirevision=f"{selected_container}-{window_key}"
+    )
+    return fig
 
 
 if __name__ == "__main__":
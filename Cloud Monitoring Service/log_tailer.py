@@ -0,0 +1,160 @@
+import re
+import subprocess
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# Containers on LOCAL_VM (where the dashboard runs) are tailed without SSH
+from cloud_logging import LOCAL_VM, RECONNECT_BACKOFF_MAX, ssh_command
+
+LOG_BUFFER_LINES = 5000  # lines kept per container
+DEFAULT_FILTERS = [r"GET /metrics"]  # health/metrics polling noise
+
+# `docker logs --timestamps` prefix: RFC 3339 with up to nanosecond precision
+TIMESTAMP_RE = re.compile(r"^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.(\d+))?(Z|[+-]\d\d:\d\d) (.*)$")
+
+
+def parse_log_line(line):
+    """Split a timestamped log line into (sort key, timestamp, text).
+
+    The sort key is (epoch seconds, nanoseconds) so daemons that print
+    different offsets or trim trailing zeros still compare correctly. Lines
+    without a timestamp (e.g. ssh errors) return (None, None, line).
+    """
+    match = TIMESTAMP_RE.match(line)
+    if not match:
+        return None, None, line
+    seconds, fraction, offset, text = match.groups()
+    try:
+        epoch = datetime.fromisoformat(f"{seconds}{'+00:00' if offset == 'Z' else offset}").timestamp()
+    except ValueError:
+        return None, None, line
+    nanos = int((fraction or "0")[:9].ljust(9, "0"))
+    timestamp = line[:len(line) - len(text) - 1]
+    return (int(epoch), nanos), timestamp, text
+
+
+class LogTailer:
+    """Follows `docker logs -f` for one container into a bounded ring buffer.
+
+    Lines matching any filter are dropped on arrival, so readers only ever
+    search what is worth showing. If the stream ends it is restarted from the
+    container-side timestamp of the last line received; lines at or before
+    that point which were already seen are skipped, so nothing is repeated.
+    """
+
+    def __init__(self, container_name, vm_host=None, max_lines=LOG_BUFFER_LINES,
+                 filters=DEFAULT_FILTERS, since="1m"):
+        self.container_name = container_name
+        self.vm_host = vm_host
+        self.since = since
+        self.filtered_count = 0
+        self._filters = [re.compile(pattern) for pattern in filters]
+        self._buffer = deque(maxlen=max_lines)  # (received_at, line)
+        self._last_key = None        # sort key of the newest timestamped line
+        self._last_timestamp = None  # the same timestamp as the daemon printed it
+        self._seen_at_last = set()   # texts already read at exactly that timestamp
+        self._lock = threading.Lock()
+        self._proc = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name=f"logs-{container_name}", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        proc = self._proc
+        if proc is not None and proc.poll() is None:
+            proc.kill()
+
+    def add_filter(self, pattern):
+        with self._lock:
+            self._filters.append(re.compile(pattern))
+
+    def _command(self, since):
+        if self.vm_host is None:
+            return ["docker", "logs", "-f", "--timestamps", "--since", since, self.container_name]
+        return ssh_command(
+            self.vm_host, f"docker logs -f --timestamps --since {since} {self.container_name} 2>&1"
+        )
+
+    def _run(self):
+        since = self.since
+        backoff = 1.0
+        while not self._stop.is_set():
+            connected_at = time.time()
+            try:
+                self._proc = subprocess.Popen(
+                    self._command(since),
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    text=True,
+                    bufsize=1,
+                    errors="replace",
+                )
+                for line in self._proc.stdout:
+                    self._handle_line(line.rstrip("\n"))
+                self._proc.wait()
+            except Exception as e:
+                self._append(f"Error: log tail for {self.container_name}: {e}")
+
+            # Resume from the daemon's own timestamp of the last line, so the
+            # cutoff does not depend on this machine's clock
+            if self._last_timestamp is not None:
+                since = self._last_timestamp
+            if time.time() - connected_at > 60:
+                backoff = 1.0
+            self._stop.wait(backoff)
+            backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+
+    def _handle_line(self, line):
+        key, timestamp, text = parse_log_line(line)
+        if key is not None:
+            # `--since` is inclusive, so a reconnect replays the boundary
+            if self._last_key is not None and key < self._last_key:
+                return
+            if key == self._last_key:
+                if text in self._seen_at_last:
+                    return
+            else:
+                self._last_key, self._last_timestamp = key, timestamp
+                self._seen_at_last = set()
+            self._seen_at_last.add(text)
+        self._append(text)
+
+    def _append(self, line):
+        with self._lock:
+            if any(pattern.search(line) for pattern in self._filters):
+                self.filtered_count += 1
+                return
+            self._buffer.append((time.time(), line))
+
+    def lines(self, since=None, search=None, limit=None):
+        """Buffered lines, oldest first, optionally newer than `since` and
+        containing `search` (case-insensitive); `limit` keeps the newest ones."""
+        needle = search.lower() if search else None
+        with self._lock:
+            entries = list(self._buffer)
+        result = [
+            line for received_at, line in entries
+            if (since is None or received_at >= since)
+            and (needle is None or needle in line.lower())
+        ]
+        if limit is not None:
+            result = result[-limit:]
+        return result
+
+
+def start_log_tailers(targets, local_vm=LOCAL_VM):
+    """Start one tailer per (vm_host, container_name) target."""
+    return {
+        container_name: LogTailer(
+            container_name, vm_host=None if vm_host == local_vm else vm_host
+        ).start()
+        for vm_host, container_name in targets
+    }
@@ -0,0 +1,192 @@
+import os
+import sqlite3
+import threading
+import time
+
+# Shared by cloud_logging.py (writer) and cloud_monitoring.py (reader)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+METRICS_DB = os.getenv("METRICS_DB", os.path.join(BASE_DIR, "container_metrics.db"))
+
+# How long samples are kept, e.g. 600 for ten minutes or 604800 for a week
+RETENTION_SECONDS = float(os.getenv("METRICS_RETENTION_SECONDS", 24 * 3600))
+PRUNE_INTERVAL = 30.0  # seconds between retention sweeps
+
+METRIC_FIELDS = (
+    "cpu_percent",
+    "memory_usage_bytes",
+    "memory_limit_bytes",
+    "memory_percent",
+    "network_rx_bytes",
+    "network_tx_bytes",
+    "uptime_seconds",
+)
+
+
+class MetricsStore:
+    """Time-series store for container metrics backed by an SQLite WAL table.
+
+    Rows are keyed by (container_name, timestamp), so appends and range reads
+    for one container only touch the tail of its index. WAL mode lets the
+    dashboard read while the collector writes, and a reader only ever sees
+    committed transactions, never a half-written file.
+    """
+
+    def __init__(self, path=METRICS_DB, retention_seconds=RETENTION_SECONDS):
+        self.path = path
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        columns = ", ".join(f"{field} REAL" for field in METRIC_FIELDS)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS container_metrics ("
+                "container_name TEXT NOT NULL, "
+                "timestamp REAL NOT NULL, "
+                f"{columns}, "
+                "PRIMARY KEY (container_name, timestamp)"
+                ") WITHOUT ROWID"
+            )
+            # Per-stage latency scraped from the services' /metrics endpoints
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS stage_timings ("
+                "container_name TEXT NOT NULL, "
+                "stage TEXT NOT NULL, "
+                "timestamp REAL NOT NULL, "
+                "count INTEGER NOT NULL, "
+                "mean_seconds REAL NOT NULL, "
+                "PRIMARY KEY (container_name, timestamp, stage)"
+                ") WITHOUT ROWID"
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # ---------- writes ----------
+
+    def append_many(self, samples):
+        """Append samples (dicts as produced by cloud_logging) in one transaction."""
+        if not samples:
+            return
+        placeholders = ", ".join("?" for _ in range(len(METRIC_FIELDS) + 2))
+        rows = [
+            (s["container_name"], s["timestamp"], *(s.get(field) for field in METRIC_FIELDS))
+            for s in samples
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO container_metrics VALUES ({placeholders})", rows
+            )
+        self.prune()
+
+    def append_stage_timings(self, rows):
+        """Append stage timing rows (container_name, stage, timestamp, count, mean_seconds)."""
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO stage_timings VALUES "
+                "(:container_name, :stage, :timestamp, :count, :mean_seconds)",
+                rows,
+            )
+
+    def prune(self, now=None, force=False):
+        """Drop samples older than the retention window (at most every PRUNE_INTERVAL)."""
+        now = time.time() if now is None else now
+        if not force and now - self._last_prune < PRUNE_INTERVAL:
+            return
+        self._last_prune = now
+        cutoff = now - self.retention_seconds
+        with self._lock, self._conn:
+            for table in ("container_metrics", "stage_timings"):
+                # One range delete per container, so each uses the primary key
+                # instead of scanning the whole table
+                for container_name in self._distinct_containers(table):
+                    self._conn.execute(
+                        f"DELETE FROM {table} WHERE container_name = ? AND timestamp < ?",
+                        (container_name, cutoff),
+                    )
+
+    def _distinct_containers(self, table):
+        """Container names in `table`, found by seeking the primary key (call with the lock)."""
+        names = []
+        row = self._conn.execute(f"SELECT MIN(container_name) FROM {table}").fetchone()
+        while row[0] is not None:
+            names.append(row[0])
+            row = self._conn.execute(
+                f"SELECT MIN(container_name) FROM {table} WHERE container_name > ?", (row[0],)
+            ).fetchone()
+        return names
+
+    # ---------- reads ----------
+
+    def containers(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT container_name FROM container_metrics"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def read_range(self, container_name, start, end=None):
+        """Samples for one container with start < timestamp <= end, oldest first."""
+        end = float("inf") if end is None else end
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM container_metrics "
+                "WHERE container_name = ? AND timestamp > ? AND timestamp <= ? "
+                "ORDER BY timestamp",
+                (container_name, start, end),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def latest(self, container_name):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM container_metrics WHERE container_name = ? "
+                "ORDER BY timestamp DESC LIMIT 1",
+                (container_name,),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def downsample(self, container_name, start, end, bucket_seconds):
+        """Aggregate CPU % and RAM % into fixed buckets for start < timestamp <= end.
+
+        Returns one dict per non-empty bucket with min/max/sum and the sample
+        count, so callers can keep merging new samples into the last bucket.
+        """
+        # Same values as series_cache.sample_values: NULLs and a zero limit count as 0
+        cpu = "COALESCE(cpu_percent, 0.0)"
+        mem = (
+            "CASE WHEN memory_limit_bytes > 0 "
+            "THEN 100.0 * COALESCE(memory_usage_bytes, 0) / memory_limit_bytes ELSE 0.0 END"
+        )
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT CAST(timestamp / :b AS INTEGER) * :b AS bucket, "
+                "COUNT(*) AS count, "
+                f"MIN({cpu}) AS cpu_min, MAX({cpu}) AS cpu_max, SUM({cpu}) AS cpu_sum, "
+                f"MIN({mem}) AS mem_min, MAX({mem}) AS mem_max, SUM({mem}) AS mem_sum "
+                "FROM container_metrics "
+                "WHERE container_name = :c AND timestamp > :start AND timestamp <= :end "
+                "GROUP BY bucket ORDER BY bucket",
+                {"b": bucket_seconds, "c": container_name, "start": start, "end": end},
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def stage_timings(self, container_name, start, bucket_seconds):
+        """Count-weighted mean latency per stage and bucket for timestamp > start."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT stage, CAST(timestamp / :b AS INTEGER) * :b AS bucket, "
+                "SUM(count) AS count, "
+                "SUM(mean_seconds * count) / SUM(count) AS mean_seconds "
+                "FROM stage_timings "
+                "WHERE container_name = :c AND timestamp > :start "
+                "GROUP BY stage, bucket ORDER BY stage, bucket",
+                {"b": bucket_seconds, "c": container_name, "start": start},
+            ).fetchall()
+        return [dict(row) for row in rows]
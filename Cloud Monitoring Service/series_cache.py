@@ -0,0 +1,159 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Chart windows: the live view uses raw samples, longer views use
+# min/max/mean buckets so the number of points per trace stays bounded
+WINDOWS = {
+    "1m": {"label": "1 min", "seconds": 60, "bucket": None},
+    "1h": {"label": "1 hour", "seconds": 3600, "bucket": 10},
+    "24h": {"label": "24 hours", "seconds": 24 * 3600, "bucket": 300},
+}
+
+REFRESH_INTERVAL = 1.0  # pull new rows from the store at most this often
+BUCKET_GRACE = 2.0      # wait for late commits before a bucket counts as complete
+
+
+def sample_values(sample):
+    """(CPU %, RAM %) for one stored sample; RAM % is derived from usage/limit."""
+    limit = sample.get("memory_limit_bytes") or 0
+    mem = 100.0 * (sample.get("memory_usage_bytes") or 0) / limit if limit else 0.0
+    return sample.get("cpu_percent") or 0.0, mem
+
+
+class BucketSeries:
+    """Rolling fixed-width buckets holding min/max/sum/count of CPU % and RAM %."""
+
+    def __init__(self, bucket_seconds, span_seconds):
+        self.bucket_seconds = bucket_seconds
+        self.span_seconds = span_seconds
+        self._buckets = OrderedDict()  # bucket start -> aggregate dict
+
+    def seed(self, rows):
+        for row in rows:
+            bucket = dict(row)
+            self._buckets[bucket.pop("bucket")] = bucket
+
+    def add(self, ts, cpu, mem):
+        start = int(ts // self.bucket_seconds) * self.bucket_seconds
+        bucket = self._buckets.get(start)
+        if bucket is None:
+            self._buckets[start] = {
+                "count": 1,
+                "cpu_min": cpu, "cpu_max": cpu, "cpu_sum": cpu,
+                "mem_min": mem, "mem_max": mem, "mem_sum": mem,
+            }
+            return
+        bucket["count"] += 1
+        bucket["cpu_min"] = min(bucket["cpu_min"], cpu)
+        bucket["cpu_max"] = max(bucket["cpu_max"], cpu)
+        bucket["cpu_sum"] += cpu
+        bucket["mem_min"] = min(bucket["mem_min"], mem)
+        bucket["mem_max"] = max(bucket["mem_max"], mem)
+        bucket["mem_sum"] += mem
+
+    def evict(self, now):
+        cutoff = now - self.span_seconds
+        while self._buckets:
+            start = next(iter(self._buckets))
+            if start + self.bucket_seconds > cutoff:
+                break
+            self._buckets.popitem(last=False)
+
+    def completed(self, after, until):
+        """Buckets starting after `after` that closed before `until`, oldest first."""
+        points = []
+        for start in reversed(self._buckets):
+            if start <= after:
+                break
+            if start + self.bucket_seconds <= until:
+                points.append((start, dict(self._buckets[start])))
+        points.reverse()
+        return points
+
+
+class SeriesCache:
+    """In-process cache of recent metrics, updated incrementally from a MetricsStore.
+
+    Each refresh only reads rows newer than the last one seen per container,
+    appends them to a raw window and folds them into the bucketed series, so
+    the work per refresh grows with new samples rather than with history.
+    """
+
+    def __init__(self, store, containers, raw_seconds=WINDOWS["1m"]["seconds"]):
+        self.store = store
+        self.containers = list(containers)
+        self.raw_seconds = raw_seconds
+        self._lock = threading.Lock()
+        self._raw = {c: deque() for c in self.containers}  # (ts, cpu, mem)
+        self._latest = {c: None for c in self.containers}
+        self._buckets = {
+            (c, key): BucketSeries(window["bucket"], window["seconds"])
+            for c in self.containers
+            for key, window in WINDOWS.items()
+            if window["bucket"]
+        }
+        self._cursor = {}
+        self._refreshed_at = 0.0
+
+    def refresh(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            if now - self._refreshed_at < REFRESH_INTERVAL:
+                return
+            for c in self.containers:
+                if c not in self._cursor:
+                    self._seed(c, now)
+                else:
+                    for sample in self.store.read_range(c, self._cursor[c]):
+                        self._ingest(c, sample)
+
+                raw = self._raw[c]
+                while raw and raw[0][0] <= now - self.raw_seconds:
+                    raw.popleft()
+                for key, window in WINDOWS.items():
+                    if window["bucket"]:
+                        self._buckets[(c, key)].evict(now)
+            self._refreshed_at = now
+
+    def _seed(self, c, now):
+        rows = self.store.read_range(c, now - self.raw_seconds)
+        cursor = rows[-1]["timestamp"] if rows else now - self.raw_seconds
+        for key, window in WINDOWS.items():
+            if window["bucket"]:
+                self._buckets[(c, key)].seed(
+                    self.store.downsample(c, now - window["seconds"], cursor, window["bucket"])
+                )
+        for sample in rows:
+            self._raw[c].append((sample["timestamp"], *sample_values(sample)))
+        if rows:
+            self._latest[c] = rows[-1]
+        self._cursor[c] = cursor
+
+    def _ingest(self, c, sample):
+        ts = sample["timestamp"]
+        cpu, mem = sample_values(sample)
+        self._raw[c].append((ts, cpu, mem))
+        for key, window in WINDOWS.items():
+            if window["bucket"]:
+                self._buckets[(c, key)].add(ts, cpu, mem)
+        self._latest[c] = sample
+        self._cursor[c] = ts
+
+    # ---------- reads ----------
+
+    def latest(self, c):
+        with self._lock:
+            return self._latest.get(c)
+
+    def raw_points(self, c, after):
+        """Raw (ts, cpu, mem) samples newer than `after`."""
+        with self._lock:
+            return [p for p in self._raw[c] if p[0] > after]
+
+    def bucket_points(self, c, window_key, after):
+        """Completed (bucket_start, aggregate) pairs newer than `after`."""
+        with self._lock:
+            return self._buckets[(c, window_key)].completed(
+                after, self._refreshed_at - BUCKET_GRACE
+            )
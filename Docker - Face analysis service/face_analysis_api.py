@@ -1,6 +1,5 @@
 from fastapi import FastAPI, Query, HTTPException
-from fastapi.responses import JSONResponse
-from scipy.spatial.distance import cosine
+from fastapi.responses import JSONResponse, Response
 from typing import List, Dict
 from PIL import Image
 import numpy as np
@@ -9,7 +8,10 @@ import os
 import io
 import uvicorn
 
+from stage_metrics import METRICS_CONTENT_TYPE, StageMetrics, render_metrics
+
 app = FastAPI()
+metrics = StageMetrics("face-analysis-api")
 
 EMBEDDINGS_FOLDER = "/home/bngl1/projects/cs5939/embeddings"
 IMAGES_FOLDER = "/home/bngl1/projects/cs5939/face_images"
@@ -26,6 +28,40 @@ def encode_image_to_base64(image_path: str):
         return None
 
 
+def cluster_embeddings(embeddings: Dict[str, np.ndarray], threshold: float = 0.3) -> List[List[str]]:
+    """Greedy grouping: each unassigned face takes every later unassigned face
+    within `threshold` cosine distance. Faces are taken in dict order."""
+    names = list(embeddings)
+    if not names:
+        return []
+
+    vectors = np.stack([np.asarray(embeddings[name], dtype=np.float64).ravel() for name in names])
+    norms = np.linalg.norm(vectors, axis=1)
+    valid = norms > 0  # a zero vector has no cosine distance to anything
+    unit = np.zeros_like(vectors)
+    unit[valid] = vectors[valid] / norms[valid, None]
+
+    unused = np.ones(len(names), dtype=bool)
+    groups = []
+    for i in range(len(names)):
+        if not unused[i]:
+            continue
+        unused[i] = False
+        group = [names[i]]
+        if valid[i]:
+            matches = unused & valid & (1.0 - unit @ unit[i] < threshold)
+            group.extend(names[j] for j in np.flatnonzero(matches))
+            unused &= ~matches
+        groups.append(group)
+    return groups
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Stage latency histograms and counters in Prometheus text format."""
+    return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+
 @app.get("/cluster_video_faces")
 def cluster_video_faces(
     video_name: str = Query(...),
@@ -44,57 +80,45 @@ def cluster_video_faces(
         )
 
     # Load all embeddings
-    embeddings = {
-        f[:-4]: np.load(f"{EMBEDDINGS_FOLDER}/{f}")
-        for f in files
-    }
+    with metrics.stage("embedding_load"):
+        embeddings = {
+            f[:-4]: np.load(f"{EMBEDDINGS_FOLDER}/{f}")
+            for f in files
+        }
 
     # Clustering logic
-    groups = []
-    used = set()
-
-    for name1, emb1 in embeddings.items():
-        if name1 in used:
-            continue
-
-        group = [name1]
-        used.add(name1)
-
-        for name2, emb2 in embeddings.items():
-            if name2 not in used:
-                dist = cosine(emb1, emb2)
-                if dist < threshold:
-                    group.append(name2)
-                    used.add(name2)
-
-        groups.append(group)
+    with metrics.stage("clustering"):
+        groups = cluster_embeddings(embeddings, threshold)
 
     # Build JSON response
-    response = {
-        "video_name": video_name,
-        "threshold": threshold,
-        "num_persons": len(groups),
-        "groups": []
-    }
-
-    for i, group in enumerate(groups, 1):
-        group_data = {
-            "person_id": i,
-            "faces": []
+    with metrics.stage("response_encoding"):
+        response = {
+            "video_name": video_name,
+            "threshold": threshold,
+            "num_persons": len(groups),
+            "groups": []
         }
 
-        for name in group:
-            img_path = f"{IMAGES_FOLDER}/{name}.jpg"
-            img_base64 = encode_image_to_base64(img_path)
+        for i, group in enumerate(groups, 1):
+            group_data = {
+                "person_id": i,
+                "faces": []
+            }
+
+            for name in group:
+                img_path = f"{IMAGES_FOLDER}/{name}.jpg"
+                img_base64 = encode_image_to_base64(img_path)
+
+                group_data["faces"].append({
+                    "name": name,
+                    "image_base64": img_base64
+                })
 
-            group_data["faces"].append({
-                "name": name,
-                "image_base64": img_base64
-            })
+            response["groups"].append(group_data)
 
-        response["groups"].append(group_data)
+        json_response = JSONResponse(content=response)
 
-    return JSONResponse(content=response)
+    return json_response
 
 
 # -------------------------------
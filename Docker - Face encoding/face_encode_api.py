@@ -1,4 +1,5 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Header
+from fastapi.responses import Response
 import io
 import uvicorn
 import numpy as np
@@ -6,7 +7,10 @@ from deepface import DeepFace
 import os
 import tempfile
 
+from stage_metrics import METRICS_CONTENT_TYPE, StageMetrics, render_metrics
+
 app = FastAPI()
+metrics = StageMetrics("face-encode-api")
 
 ENCODER_URL = os.getenv("ENCODER_URL", "http://localhost:8001/encode")
 ENCODER_API_PORT = int(os.getenv("ENCODER_API_PORT", 8001))
@@ -23,9 +27,63 @@ os.makedirs(EMB_DIR, exist_ok=True)
 IMG_DIR = os.path.join(BASE_DIR, OUTPUT_IMAGE_DIR)
 os.makedirs(IMG_DIR, exist_ok=True)
 
+def write_atomic(path, data):
+    """Write bytes via a temp file + rename so a retry never sees a torn file."""
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def already_encoded(emb_path, img_path, contents):
+    """True if this exact image was stored and encoded by an earlier delivery."""
+    if not (os.path.exists(emb_path) and os.path.exists(img_path)):
+        return False
+    with open(img_path, "rb") as f:
+        return f.read() == contents
+
+
+def compute_embedding(img):
+    """Facenet512 embedding of one face crop (an image path or a BGR array)."""
+    with metrics.stage("deepface_inference"):
+        emb = DeepFace.represent(
+            img_path=img,
+            model_name="Facenet512",
+            enforce_detection=False
+        )[0]["embedding"]
+    return np.array(emb)
+
+
+def face_paths(filename, emb_dir=EMB_DIR, img_dir=IMG_DIR):
+    """(embedding path, image path) of an uploaded face image."""
+    emb_path = os.path.join(emb_dir, f"{os.path.splitext(filename)[0]}.npy")
+    img_path = os.path.join(img_dir, filename)
+    return emb_path, img_path
+
+
+def store_face(emb_path, img_path, emb, jpeg_bytes):
+    """Write the face image, then its embedding."""
+    with metrics.stage("embedding_write"):
+        write_atomic(img_path, jpeg_bytes)
+
+        # Save embedding last: its presence marks the face as done
+        buffer = io.BytesIO()
+        np.save(buffer, emb)
+        write_atomic(emb_path, buffer.getvalue())
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Stage latency histograms and counters in Prometheus text format."""
+    return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+
 @app.post("/encode")
-async def encode_image(file: UploadFile = File(...)):
-    print(f"✅ Received: {file.filename} ({file.content_type})")
+async def encode_image(
+    file: UploadFile = File(...),
+    x_trace_id: str | None = Header(None),
+):
+    print(f"✅ Received: {file.filename} ({file.content_type}) (trace={x_trace_id})")
 
     contents = await file.read()
 
@@ -42,40 +100,42 @@ async def encode_image(file: UploadFile = File(...)):
 
     print(f"✅ Valid JPEG image: {file.filename}")
 
+    emb_path, img_path = face_paths(file.filename)
+
+    # The extractor retries until it gets a 2xx, so the same face can arrive twice
+    if already_encoded(emb_path, img_path, contents):
+        print(f"♻️ Already encoded, skipping: {file.filename} (trace={x_trace_id})")
+        return {
+            "status": "already encoded",
+            "file": file.filename,
+            "vector_path": emb_path,
+            "image_path": img_path,
+            "trace_id": x_trace_id
+        }
+
     # Save temp file for DeepFace
     try:
         with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
             temp_file.write(contents)
             temp_file_path = temp_file.name
 
-        emb = DeepFace.represent(
-            img_path=temp_file_path,
-            model_name="Facenet512",
-            enforce_detection=False
-        )[0]["embedding"]
-
-        emb = np.array(emb)
+        emb = compute_embedding(temp_file_path)
         print(f"✅ Embedding generated, shape: {emb.shape}")
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"❌ DeepFace error: {str(e)}")
 
-    # Save embedding
-    emb_path = os.path.join(EMB_DIR, f"{os.path.splitext(file.filename)[0]}.npy")
-    np.save(emb_path, emb)
-    print(f"✅ Embedding saved to {emb_path}")
-
-    # 👉 NEW: Save the uploaded JPEG image
-    img_path = os.path.join(IMG_DIR, file.filename)
-    with open(img_path, "wb") as img_file:
-        img_file.write(contents)
+    # 👉 NEW: Save the uploaded JPEG image next to its embedding
+    store_face(emb_path, img_path, emb, contents)
     print(f"📸 Image saved to {img_path}")
+    print(f"✅ Embedding saved to {emb_path} (trace={x_trace_id})")
 
     return {
         "status": "embedding created",
         "file": file.filename,
         "vector_path": emb_path,
-        "image_path": img_path
+        "image_path": img_path,
+        "trace_id": x_trace_id
     }
 
 if __name__ == "__main__":
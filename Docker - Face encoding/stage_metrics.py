@@ -0,0 +1,61 @@
+"""Stage timing instrumentation shared by the face services.
+
+Each service image is built from its own folder, so this file is kept
+identical in all three service folders.
+"""
+import time
+import uuid
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+
+# Header that carries a trace id from /capture_faces through /encode
+TRACE_HEADER = "X-Trace-Id"
+
+STAGE_SECONDS = Histogram(
+    "face_pipeline_stage_seconds",
+    "Time spent in one stage of the face pipeline",
+    ["service", "stage"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+             0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+STAGE_TOTAL = Counter(
+    "face_pipeline_stage",
+    "Number of times a stage ran, by outcome",
+    ["service", "stage", "outcome"],
+)
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+
+def new_trace_id():
+    return uuid.uuid4().hex[:16]
+
+
+def render_metrics():
+    """All registered metrics in Prometheus text format."""
+    return generate_latest()
+
+
+class StageMetrics:
+    """Latency histogram + outcome counter per stage for one service."""
+
+    def __init__(self, service):
+        self.service = service
+
+    def observe(self, stage, seconds, outcome="ok"):
+        STAGE_SECONDS.labels(self.service, stage).observe(seconds)
+        STAGE_TOTAL.labels(self.service, stage, outcome).inc()
+
+    @contextmanager
+    def stage(self, stage):
+        """Time the enclosed block; an exception is counted as an error and re-raised."""
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            yield
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start, outcome)
@@ -4,107 +4,237 @@ import mediapipe as mp
 import numpy as np
 import os
 import re
-import asyncio
-import httpx
-import threading
 from datetime import datetime
 
+from face_spool import get_spool
+from stage_metrics import StageMetrics
+
+metrics = StageMetrics("face-extract-api")
+
 # ======================
-# Async API Sender
+# Per-frame Face Analysis
 # ======================
 
-async def send_to_encoder(image_path, encoder_url):
-    async with httpx.AsyncClient() as client:
-        try:
-            with open(image_path, "rb") as f:
-                files = {"file": (os.path.basename(image_path), f, "image/jpeg")}
-                response = await client.post(encoder_url, files=files, timeout=5)
-                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ✅ Sent {os.path.basename(image_path)} to encoder: {response.status_code}", flush=True)
-        except Exception as e:
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ⚠️ Failed to send {os.path.basename(image_path)}: {e}", flush=True)
+def estimate_head_pose(image, landmarks, image_w, image_h):
+    indices = [1, 33, 263, 61, 291, 199]
+    image_points = np.array([
+        (int(landmarks[idx].x * image_w), int(landmarks[idx].y * image_h)) for idx in indices
+    ], dtype="double")
+
+    model_points = np.array([
+        (0.0, 0.0, 0.0),
+        (-30.0, -30.0, -30.0),
+        (30.0, -30.0, -30.0),
+        (-30.0, 30.0, -30.0),
+        (30.0, 30.0, -30.0),
+        (0.0, 50.0, -10.0)
+    ])
+
+    focal_length = image_w
+    center = (image_w / 2, image_h / 2)
+    camera_matrix = np.array([
+        [focal_length, 0, center[0]],
+        [0, focal_length, center[1]],
+        [0, 0, 1]
+    ], dtype="double")
+
+    success, rotation_vector, _ = cv2.solvePnP(
+        model_points, image_points, camera_matrix, np.zeros((4, 1))
+    )
+
+    if not success:
+        return None, None, None
 
+    rmat, _ = cv2.Rodrigues(rotation_vector)
+    angles, _, _, _, _, _ = cv2.RQDecomp3x3(rmat)
+    return angles[0], angles[1], angles[2]
+
+
+class FaceAnalyzer:
+    """Detector + mesh + head-pose checks for single frames.
+
+    MediaPipe graphs are not thread-safe, so each thread needs its own
+    analyzer. Use static_image_mode=True when consecutive frames may come
+    from different streams.
+    """
+
+    def __init__(
+        self,
+        min_detection_confidence=0.9,
+        brightness_threshold=40,
+        max_pitch=10,
+        max_yaw=20,
+        max_num_faces=1,
+        static_image_mode=False,
+    ):
+        self.brightness_threshold = brightness_threshold
+        self.max_pitch = max_pitch
+        self.max_yaw = max_yaw
+        self.face_detection = mp.solutions.face_detection.FaceDetection(
+            min_detection_confidence=min_detection_confidence
+        )
+        self.face_mesh = mp.solutions.face_mesh.FaceMesh(
+            static_image_mode=static_image_mode,
+            max_num_faces=max_num_faces,
+            refine_landmarks=True
+        )
+
+    def find_valid_face(self, image, rgb_image=None):
+        """Crop of the first bright, frontal face in a BGR frame, or None."""
+        if rgb_image is None:
+            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+        with metrics.stage("detection"):
+            results = self.face_detection.process(rgb_image)
+        if not results.detections:
+            return None
+
+        for detection in results.detections:
+            bbox = detection.location_data.relative_bounding_box
+            h, w, _ = image.shape
+            xmin, ymin = max(0, int(bbox.xmin * w)), max(0, int(bbox.ymin * h))
+            xmax, ymax = min(w, int((bbox.xmin + bbox.width) * w)), min(h, int((bbox.ymin + bbox.height) * h))
+            face_roi = image[ymin:ymax, xmin:xmax]
+
+            hsv = cv2.cvtColor(face_roi, cv2.COLOR_BGR2HSV)
+            if np.mean(hsv[:, :, 2]) < self.brightness_threshold:
+                continue
+
+            with metrics.stage("mesh"):
+                mesh_results = self.face_mesh.process(rgb_image)
+            if not mesh_results.multi_face_landmarks:
+                continue
+
+            face_landmarks = mesh_results.multi_face_landmarks[0]
+            with metrics.stage("pose"):
+                pitch, yaw, roll = estimate_head_pose(image, face_landmarks.landmark, w, h)
+            if pitch is None or abs(pitch) > self.max_pitch or abs(yaw) > self.max_yaw:
+                continue
+
+            return face_roi
+        return None
+
+    def close(self):
+        self.face_detection.close()
+        self.face_mesh.close()
+
+
+class FaceStreak:
+    """Stability streak of one stream: fires once per streak of valid frames
+    lasting at least `stable_sec`."""
+
+    def __init__(self, stable_sec):
+        self.stable_sec = stable_sec
+        self.face_valid_since = None
+        self.face_saved_this_streak = False
+
+    def update(self, face_is_valid, current_time):
+        """Feed one frame; True when this frame's face should be saved."""
+        if not face_is_valid:
+            self.face_valid_since = None
+            self.face_saved_this_streak = False
+            return False
+
+        if self.face_valid_since is None:
+            self.face_valid_since = current_time
+            self.face_saved_this_streak = False
+
+        if self.face_saved_this_streak or (current_time - self.face_valid_since) < self.stable_sec:
+            return False
+        self.face_saved_this_streak = True
+        return True
+
+
+class StableFaceSaver:
+    """Streak state for one stream: saves and queues one face per stable streak.
+
+    Faces are named "<name>_img<n>" and sent with trace id "<trace_id>-<n>".
+    """
+
+    def __init__(self, name, image_dir, stable_sec, spool, trace_id=None):
+        self.name = name
+        self.stable_sec = stable_sec
+        self.spool = spool
+        self.trace_id = trace_id
+        self.img_count = 0
+        self.streak = FaceStreak(stable_sec)
+
+        # Ensure directory exists
+        BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+        self.image_dir_root = os.path.join(BASE_DIR, image_dir)
+        os.makedirs(self.image_dir_root, exist_ok=True)
+
+    def update(self, face_roi, current_time):
+        """Feed one frame's result; returns the saved image path, if any."""
+        if self.streak.update(face_roi is not None, current_time):
+            return self.save(face_roi)
+        return None
+
+    def save(self, face_roi):
+        # Build the filename
+        face_filename_base = f"{self.name}_img{self.img_count}"
+
+        # Save image
+        face_image_path = os.path.join(self.image_dir_root, f"{face_filename_base.strip()}.jpg")
+        with metrics.stage("crop_save"):
+            _, jpeg = cv2.imencode(".jpg", face_roi)
+            jpeg_bytes = jpeg.tobytes()
+            with open(face_image_path, "wb") as f:
+                f.write(jpeg_bytes)
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 📸 Saved after {self.stable_sec}s stable: {face_image_path}", flush=True)
+
+        # Queue durably for the encoder; delivery workers send it
+        face_trace_id = f"{self.trace_id}-{self.img_count}" if self.trace_id else None
+        self.spool.enqueue(os.path.basename(face_image_path), jpeg_bytes, face_trace_id)
+
+        self.img_count += 1  # increment for each saved image
+        return face_image_path
 
-def send_to_encoder_background(image_path, encoder_url):
-    """Runs the async function in a background event loop safely."""
-    def run():
-        asyncio.run(send_to_encoder(image_path, encoder_url))
-    threading.Thread(target=run, daemon=True).start()
 
 # ======================
 # Face Capture Logic
 # ======================
 
-def capture_stable_faces(
+def video_name_for(video_path):
+    """Prefix used for the faces of one input ("camera" for the live device)."""
+    if video_path:
+        return os.path.splitext(os.path.basename(video_path))[0]
+    return "camera"
+
+
+def iter_stable_faces(
     use_camera=True,
     video_path=None,
-    image_dir="Face image",
     stable_sec=1.25,
     min_detection_confidence=0.9,
     brightness_threshold=40,
     max_pitch=10,
     max_yaw=20,
     max_num_faces=1,
-    encoder_url="http://localhost:8001/encode",  # 🔹 new configurable parameter
+    before_frame=None,  # called before every frame read, e.g. for backpressure
 ):
+    """Yield the BGR crop of each face that stayed valid for `stable_sec`."""
     if not use_camera and (video_path is None or not os.path.exists(video_path)):
         raise ValueError("video_path must be provided and valid when use_camera=False")
 
-    os.makedirs(image_dir, exist_ok=True)
-
     cap = cv2.VideoCapture(0 if use_camera else video_path)
     if not cap.isOpened():
         raise RuntimeError("Cannot open camera or video")
 
-    mp_face_detection = mp.solutions.face_detection
-    mp_face_mesh = mp.solutions.face_mesh
-    face_detection = mp_face_detection.FaceDetection(min_detection_confidence=min_detection_confidence)
-    face_mesh = mp_face_mesh.FaceMesh(
-        static_image_mode=False,
+    analyzer = FaceAnalyzer(
+        min_detection_confidence=min_detection_confidence,
+        brightness_threshold=brightness_threshold,
+        max_pitch=max_pitch,
+        max_yaw=max_yaw,
         max_num_faces=max_num_faces,
-        refine_landmarks=True
     )
-
-    def estimate_head_pose(image, landmarks, image_w, image_h):
-        indices = [1, 33, 263, 61, 291, 199]
-        image_points = np.array([
-            (int(landmarks[idx].x * image_w), int(landmarks[idx].y * image_h)) for idx in indices
-        ], dtype="double")
-
-        model_points = np.array([
-            (0.0, 0.0, 0.0),
-            (-30.0, -30.0, -30.0),
-            (30.0, -30.0, -30.0),
-            (-30.0, 30.0, -30.0),
-            (30.0, 30.0, -30.0),
-            (0.0, 50.0, -10.0)
-        ])
-
-        focal_length = image_w
-        center = (image_w / 2, image_h / 2)
-        camera_matrix = np.array([
-            [focal_length, 0, center[0]],
-            [0, focal_length, center[1]],
-            [0, 0, 1]
-        ], dtype="double")
-
-        success, rotation_vector, _ = cv2.solvePnP(
-            model_points, image_points, camera_matrix, np.zeros((4, 1))
-        )
-
-        if not success:
-            return None, None, None
-
-        rmat, _ = cv2.Rodrigues(rotation_vector)
-        angles, _, _, _, _, _ = cv2.RQDecomp3x3(rmat)
-        return angles[0], angles[1], angles[2]
-
-    face_valid_since = None
-    face_saved_this_streak = False
+    streak = FaceStreak(stable_sec)
 
     try:
-        img_count = 0  
-
         while cap.isOpened():
+            if before_frame is not None:
+                before_frame()
+
             current_time = (
                 cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
                 if not use_camera else time.time()
@@ -112,76 +242,56 @@ def capture_stable_faces(
             if current_time < 0:
                 current_time = time.time()
 
-            success, image = cap.read()
+            with metrics.stage("frame_decode"):
+                success, image = cap.read()
+                if success:
+                    rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
             if not success:
                 print("End of video or failed to read frame.")
                 break
 
-            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            results = face_detection.process(rgb_image)
-            face_is_valid = False
-
-            if results.detections:
-                for detection in results.detections:
-                    bbox = detection.location_data.relative_bounding_box
-                    h, w, _ = image.shape
-                    xmin, ymin = max(0, int(bbox.xmin * w)), max(0, int(bbox.ymin * h))
-                    xmax, ymax = min(w, int((bbox.xmin + bbox.width) * w)), min(h, int((bbox.ymin + bbox.height) * h))
-                    face_roi = image[ymin:ymax, xmin:xmax]
+            face_roi = analyzer.find_valid_face(image, rgb_image)
+            if streak.update(face_roi is not None, current_time):
+                yield face_roi
 
-                    hsv = cv2.cvtColor(face_roi, cv2.COLOR_BGR2HSV)
-                    if np.mean(hsv[:, :, 2]) < brightness_threshold:
-                        continue
-
-                    mesh_results = face_mesh.process(rgb_image)
-                    if not mesh_results.multi_face_landmarks:
-                        continue
-
-                    face_landmarks = mesh_results.multi_face_landmarks[0]
-                    pitch, yaw, roll = estimate_head_pose(image, face_landmarks.landmark, w, h)
-                    if pitch is None or abs(pitch) > max_pitch or abs(yaw) > max_yaw:
-                        continue
-
-                    face_is_valid = True
-
-                    if face_valid_since is None:
-                        face_valid_since = current_time
-                        face_saved_this_streak = False
-
-                    # Saved the face
-                    if not face_saved_this_streak and (current_time - face_valid_since) >= stable_sec:                    
-
-                        # Get video name
-                        if video_path:
-                            video_name = os.path.splitext(os.path.basename(video_path))[0]
-                        else:
-                            video_name = "camera"
-
-                        # Build the filename
-                        face_filename_base = f"{video_name}_img{img_count}"
-
-                        # Ensure directory exists
-                        BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-                        image_dir_root = os.path.join(BASE_DIR, image_dir)
-                        os.makedirs(image_dir_root, exist_ok=True)
-
-                        # Save image
-                        face_image_path = os.path.join(image_dir_root, f"{face_filename_base.strip()}.jpg")
-                        cv2.imwrite(face_image_path, face_roi)
-                        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 📸 Saved after {stable_sec}s stable: {face_image_path}", flush=True)
-
-                        # Send to encoder asynchronously
-                        send_to_encoder_background(face_image_path, encoder_url)
+    finally:
+        cap.release()
+        analyzer.close()
 
-                        img_count += 1  # increment for each saved image
-                        face_saved_this_streak = True
-                    break
 
-            if not face_is_valid:
-                face_valid_since = None
-                face_saved_this_streak = False
+def capture_stable_faces(
+    use_camera=True,
+    video_path=None,
+    image_dir="Face image",
+    stable_sec=1.25,
+    min_detection_confidence=0.9,
+    brightness_threshold=40,
+    max_pitch=10,
+    max_yaw=20,
+    max_num_faces=1,
+    trace_id=None,  # each saved face is sent as "<trace_id>-<img_count>"
+    spool=None,  # outbound FaceSpool (it owns the encoder URL); defaults to the process-wide one
+    max_wait=None,  # seconds capture may stay paused on a full spool (None = no limit)
+):
+    if not use_camera and (video_path is None or not os.path.exists(video_path)):
+        raise ValueError("video_path must be provided and valid when use_camera=False")
 
-    finally:
-        cap.release()
-        face_detection.close()
-        face_mesh.close()
+    os.makedirs(image_dir, exist_ok=True)
+    spool = spool or get_spool()
+    saver = StableFaceSaver(video_name_for(video_path), image_dir, stable_sec,
+                            spool, trace_id)
+
+    faces = iter_stable_faces(
+        use_camera=use_camera,
+        video_path=video_path,
+        stable_sec=stable_sec,
+        min_detection_confidence=min_detection_confidence,
+        brightness_threshold=brightness_threshold,
+        max_pitch=max_pitch,
+        max_yaw=max_yaw,
+        max_num_faces=max_num_faces,
+        # Backpressure: stop reading frames while the encoder is behind
+        before_frame=lambda: spool.wait_for_capacity(max_wait),
+    )
+    for face_roi in faces:
+        saver.save(face_roi)
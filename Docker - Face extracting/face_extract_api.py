@@ -1,17 +1,23 @@
 import os
 import shutil
+import threading
 from datetime import datetime
-from fastapi import FastAPI, UploadFile, File
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, Header, HTTPException
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 from dotenv import load_dotenv
-from face_capture import capture_stable_faces  # import your existing function
+from pydantic import BaseModel
 
 # ======================
 # 🌍 Load environment variables
 # ======================
-load_dotenv()  # Reads values from .env file
+load_dotenv()  # Reads values from .env file (before face_spool reads its settings)
+
+from face_capture import capture_stable_faces  # import your existing function
+from face_spool import SPOOL_MAX_WAIT, SpoolFullError, get_spool
+from stream_supervisor import StreamSupervisor
+from stage_metrics import METRICS_CONTENT_TYPE, TRACE_HEADER, new_trace_id, render_metrics
 
 # Extract API configuration
 EXTRACT_URL = os.getenv("EXTRACT_URL", "http://localhost:8000")
@@ -45,21 +51,47 @@ def log(msg):
 # ======================
 # 🎥 API Endpoint
 # ======================
+@app.on_event("startup")
+def start_spool():
+    # Resume delivering any faces left in the spool by a previous run
+    get_spool()
+
+
+@app.on_event("shutdown")
+def stop_spool():
+    if supervisor is not None:
+        supervisor.close()
+    get_spool().close()
+
+
+@app.get("/health")
+def health():
+    return {"status": "ok", "spool": get_spool().status()}
+
+
 @app.get("/metrics")
 def metrics():
-    return {"status": "ok"}
+    """Stage latency histograms and counters in Prometheus text format."""
+    return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
 
 
+# A plain def runs in the threadpool: a capture paused by spool backpressure
+# must not block /health, /metrics or /streams on the event loop
 @app.post("/capture_faces")
-async def capture_faces(video: UploadFile = File(...)):
+def capture_faces(
+    video: UploadFile = File(...),
+    x_trace_id: str | None = Header(None),
+):
     """Takes a video input, runs face capture, and returns status."""
+    trace_id = x_trace_id or new_trace_id()
+    temp_video_path = None
     try:
         BASE_DIR = os.path.dirname(os.path.abspath(__file__))
         upload_dir = os.path.join(BASE_DIR, "uploaded_videos")
         os.makedirs(upload_dir, exist_ok=True)
 
         temp_video_path = os.path.join(upload_dir, video.filename)
-        log(f"📂 Temp video path: {temp_video_path}")
+        log(f"📂 Temp video path: {temp_video_path} (trace={trace_id})")
 
         with open(temp_video_path, "wb") as buffer:
             shutil.copyfileobj(video.file, buffer)
@@ -76,29 +108,99 @@ async def capture_faces(video: UploadFile = File(...)):
             brightness_threshold=40,
             max_pitch=10,
             max_yaw=20,
-            encoder_url=ENCODER_URL
+            trace_id=trace_id,
+            spool=get_spool(),
+            max_wait=SPOOL_MAX_WAIT
         )
-        log(f"✅ Finished processing: {video.filename}")
+        log(f"✅ Finished processing: {video.filename} (trace={trace_id})")
 
         return JSONResponse({
             "status": "success",
             "message": f"Processed {video.filename}",
-            "saved_dir": IMAGE_DIR
-        })
+            "saved_dir": IMAGE_DIR,
+            "trace_id": trace_id
+        }, headers={TRACE_HEADER: trace_id})
+
+    except SpoolFullError as e:
+        log(f"⏳ Gave up on {video.filename}: {e} (trace={trace_id})")
+        return JSONResponse({"status": "error", "error": str(e), "trace_id": trace_id},
+                            status_code=503, headers={TRACE_HEADER: trace_id})
 
     except Exception as e:
-        log(f"❌ Error processing {video.filename}: {e}")
-        return JSONResponse({"status": "error", "error": str(e)}, status_code=500)
+        log(f"❌ Error processing {video.filename}: {e} (trace={trace_id})")
+        return JSONResponse({"status": "error", "error": str(e), "trace_id": trace_id},
+                            status_code=500, headers={TRACE_HEADER: trace_id})
 
     finally:
         try:
-            if os.path.exists(temp_video_path):
+            if temp_video_path and os.path.exists(temp_video_path):
                 os.remove(temp_video_path)
                 log(f"🗑️ Temp file removed: {temp_video_path}")
         except Exception as cleanup_err:
             log(f"⚠️ Cleanup failed: {cleanup_err}")
 
 
+# ======================
+# 📡 Live Streams
+# ======================
+supervisor = None
+supervisor_lock = threading.Lock()
+
+
+def get_supervisor():
+    """Shared inference workers are only started once a stream is requested."""
+    global supervisor
+    with supervisor_lock:
+        if supervisor is None:
+            supervisor = StreamSupervisor(
+                spool=get_spool(),
+                image_dir=IMAGE_DIR,
+                stable_sec=1.25,
+                min_detection_confidence=0.9,
+                brightness_threshold=40,
+                max_pitch=10,
+                max_yaw=20,
+            )
+        return supervisor
+
+
+class StreamRequest(BaseModel):
+    name: str
+    source: str  # camera index ("0"), video file path or stream URL
+    realtime: bool = True  # play files at their frame rate, like a camera
+
+
+@app.post("/streams")
+def start_stream(request: StreamRequest):
+    """Start watching a source; saved faces are named "<name>_img<n>"."""
+    try:
+        status = get_supervisor().start_stream(request.name, request.source, request.realtime)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    log(f"🎥 Stream started: {request.name} ({request.source})")
+    return status
+
+
+@app.delete("/streams/{name}")
+def stop_stream(name: str):
+    try:
+        if supervisor is None:
+            raise KeyError(name)
+        status = supervisor.stop_stream(name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Stream '{name}' not found")
+    log(f"⏹️ Stream stopped: {name}")
+    return status
+
+
+@app.get("/streams")
+def list_streams():
+    # Reporting status must not start the worker pool
+    if supervisor is None:
+        return {"workers": 0, "streams": []}
+    return supervisor.status()
+
+
 # ======================
 # 🟢 Run the API
 # ======================
@@ -0,0 +1,333 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import httpx
+from prometheus_client import Gauge
+
+from stage_metrics import TRACE_HEADER, StageMetrics
+
+# ======================
+# Configuration
+# ======================
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SPOOL_DIR = os.path.join(BASE_DIR, os.getenv("SPOOL_DIR", "spool"))
+ENCODER_URL = os.getenv("ENCODER_URL", "http://localhost:8001/encode")
+
+SPOOL_HIGH_WATER = int(os.getenv("SPOOL_HIGH_WATER", 200))  # pause capture above this
+SPOOL_LOW_WATER = int(os.getenv("SPOOL_LOW_WATER", 100))    # resume capture below this
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", 4))
+SPOOL_MAX_WAIT = float(os.getenv("SPOOL_MAX_WAIT", 300))  # longest an upload waits for room
+SPOOL_MAX_ATTEMPTS = int(os.getenv("SPOOL_MAX_ATTEMPTS", 8))  # encoder errors before a face is dead
+
+FLUSH_INTERVAL = 0.05  # seconds a face may wait for its batch to be fsynced
+FLUSH_BATCH = 32       # faces committed (and fsynced) together at most
+SEND_TIMEOUT = 10
+MAX_BACKOFF = 60.0
+
+metrics = StageMetrics("face-extract-api")
+SPOOL_DEPTH = Gauge("face_spool_pending", "Faces waiting in the outbound spool")
+SPOOL_DEAD = Gauge("face_spool_dead", "Faces the encoder rejected or failed on permanently")
+
+
+def log(msg):
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {msg}", flush=True)
+
+
+class SpoolFullError(RuntimeError):
+    """The spool stayed above its high-water mark for longer than allowed."""
+
+
+class FaceSpool:
+    """Durable outbound queue of face crops waiting for the encoder.
+
+    `enqueue` returns only once the face is committed to an SQLite WAL file
+    with synchronous=FULL; concurrent callers share one commit, so one fsync
+    covers a whole batch. A fixed pool of delivery workers drains the queue
+    and deletes a face only after the encoder answered 2xx, so every face is
+    delivered at least once, including after a restart. Failed sends are
+    retried with exponential backoff; permanent 4xx rejections, and faces the
+    encoder failed on `max_attempts` times, are kept as dead letters. An
+    unreachable or unavailable encoder (connection errors, 502/503/504) never
+    kills a face, so an outage is ridden out. Capture calls `wait_for_capacity` to pause while the spool
+    is above its high-water mark.
+    """
+
+    def __init__(self, path=None, encoder_url=ENCODER_URL, workers=DELIVERY_WORKERS,
+                 high_water=SPOOL_HIGH_WATER, low_water=SPOOL_LOW_WATER,
+                 max_attempts=SPOOL_MAX_ATTEMPTS):
+        if path is None:
+            os.makedirs(SPOOL_DIR, exist_ok=True)
+            path = os.path.join(SPOOL_DIR, "outbox.db")
+        self.path = path
+        # Faces always go to the currently configured encoder, so correcting
+        # ENCODER_URL also redirects faces spooled before the change
+        self.encoder_url = encoder_url
+        self.max_attempts = max_attempts
+        self.high_water = high_water
+        self.low_water = low_water
+
+        self._db_lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                "face_id TEXT PRIMARY KEY, "
+                "filename TEXT NOT NULL, "
+                "trace_id TEXT, "
+                "payload BLOB NOT NULL, "
+                "status TEXT NOT NULL DEFAULT 'pending', "
+                "attempts INTEGER NOT NULL DEFAULT 0, "
+                "next_attempt_at REAL NOT NULL, "
+                "created_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)"
+            )
+
+        # Group commit: writers append here and wait for the flusher
+        self._pending = []
+        self._flush_cond = threading.Condition()
+
+        # Delivery bookkeeping
+        self._state = threading.Condition()
+        self._in_flight = set()
+        self._depth = self._count("pending")
+        self._dead = self._count("dead")
+        SPOOL_DEPTH.set(self._depth)
+        SPOOL_DEAD.set(self._dead)
+
+        self._stop = threading.Event()
+        self._client = httpx.Client(timeout=SEND_TIMEOUT)
+        self._threads = [threading.Thread(target=self._flush_loop, name="spool-flush", daemon=True)]
+        self._threads += [
+            threading.Thread(target=self._deliver_loop, name=f"spool-send-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        if self._depth:
+            log(f"📦 Spool resumed with {self._depth} undelivered face(s)")
+
+    def _count(self, status):
+        with self._db_lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM outbox WHERE status = ?", (status,)
+            ).fetchone()[0]
+
+    # ======================
+    # Producer side
+    # ======================
+
+    def enqueue(self, filename, payload, trace_id=None):
+        """Durably queue one JPEG for delivery; blocks until it is fsynced."""
+        entry = {
+            # (face_id, filename, trace_id, payload, next_attempt_at)
+            "row": (uuid.uuid4().hex, filename, trace_id, payload, time.time()),
+            "done": threading.Event(),
+            "error": None,
+        }
+        with metrics.stage("spool_enqueue"):
+            with self._flush_cond:
+                self._pending.append(entry)
+                if len(self._pending) >= FLUSH_BATCH:
+                    self._flush_cond.notify()
+            entry["done"].wait()
+        if entry["error"] is not None:
+            raise entry["error"]
+
+    def _flush_loop(self):
+        while not self._stop.is_set() or self._pending:
+            with self._flush_cond:
+                if not self._pending:
+                    self._flush_cond.wait(FLUSH_INTERVAL)
+                batch, self._pending = self._pending, []
+            if not batch:
+                continue
+            try:
+                with self._db_lock, self._conn:
+                    self._conn.executemany(
+                        "INSERT INTO outbox (face_id, filename, trace_id, "
+                        "payload, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                        [(*e["row"], e["row"][-1]) for e in batch],
+                    )
+                with self._state:
+                    self._depth += len(batch)
+                    SPOOL_DEPTH.set(self._depth)
+                    self._state.notify_all()
+            except Exception as e:
+                for entry in batch:
+                    entry["error"] = e
+            for entry in batch:
+                entry["done"].set()
+
+    def depth(self):
+        return self._depth
+
+    def wait_for_capacity(self, timeout=None):
+        """Block while the spool is above the high-water mark (until it drains
+        below the low-water mark). Raises SpoolFullError after `timeout` seconds."""
+        if self._depth < self.high_water:
+            return
+        log(f"⏸️ Spool at {self._depth} faces (high water {self.high_water}), pausing capture")
+        deadline = None if timeout is None else time.time() + timeout
+        with self._state:
+            while self._depth > self.low_water and not self._stop.is_set():
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise SpoolFullError(
+                        f"Spool still holds {self._depth} faces after {timeout:.0f}s; "
+                        "is the encoder reachable?"
+                    )
+                self._state.wait(1.0 if remaining is None else min(remaining, 1.0))
+        if not self._stop.is_set():
+            log(f"▶️ Spool down to {self._depth} faces, resuming capture")
+
+    # ======================
+    # Delivery side
+    # ======================
+
+    def _claim(self):
+        """Oldest due face not already being sent, or the delay until one is due."""
+        now = time.time()
+        with self._state:
+            in_flight = list(self._in_flight)
+        excluded = f"AND face_id NOT IN ({', '.join('?' for _ in in_flight)}) " if in_flight else ""
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT face_id, filename, trace_id, payload, attempts, "
+                "next_attempt_at FROM outbox WHERE status = 'pending' "
+                f"{excluded}ORDER BY next_attempt_at LIMIT 1",
+                in_flight,
+            ).fetchone()
+        if row is None:
+            return None, 1.0
+        if row[5] > now:
+            return None, min(row[5] - now, 1.0)
+        with self._state:
+            if row[0] in self._in_flight:
+                return None, 0.0
+            self._in_flight.add(row[0])
+        return row, 0.0
+
+    def _deliver_loop(self):
+        while not self._stop.is_set():
+            row, delay = self._claim()
+            if row is None:
+                with self._state:
+                    self._state.wait(delay)
+                continue
+            face_id = row[0]
+            try:
+                self._deliver(*row[:5])
+            finally:
+                with self._state:
+                    self._in_flight.discard(face_id)
+
+    def _deliver(self, face_id, filename, trace_id, payload, attempts):
+        headers = {TRACE_HEADER: trace_id} if trace_id else {}
+        try:
+            with metrics.stage("encoder_send"):
+                files = {"file": (filename, payload, "image/jpeg")}
+                response = self._client.post(self.encoder_url, files=files, headers=headers)
+            status = response.status_code
+        except Exception as e:
+            status, error = None, e
+        else:
+            error = None
+
+        if status is not None and 200 <= status < 300:
+            log(f"✅ Sent {filename} to encoder: {status} (trace={trace_id})")
+            self._finish(face_id, "delete")
+        elif status is not None and 400 <= status < 500 and status not in (408, 429):
+            log(f"❌ Encoder rejected {filename}: {status} {response.text[:200]} (trace={trace_id})")
+            self._finish(face_id, "dead")
+        elif (status is not None and status >= 500 and status not in (502, 503, 504)
+              and attempts + 1 >= self.max_attempts):
+            # The encoder answered but keeps failing on this face (e.g. a DeepFace error)
+            log(f"❌ Encoder failed on {filename} {attempts + 1} times, giving up: "
+                f"{status} {response.text[:200]} (trace={trace_id})")
+            self._finish(face_id, "dead")
+        else:
+            backoff = min(2.0 ** attempts, MAX_BACKOFF)
+            log(f"⚠️ Failed to send {filename} (attempt {attempts + 1}): "
+                f"{error or status}, retrying in {backoff:.0f}s (trace={trace_id})")
+            with self._db_lock, self._conn:
+                self._conn.execute(
+                    "UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ? "
+                    "WHERE face_id = ?",
+                    (time.time() + backoff, face_id),
+                )
+
+    def _finish(self, face_id, outcome):
+        with self._db_lock, self._conn:
+            if outcome == "delete":
+                self._conn.execute("DELETE FROM outbox WHERE face_id = ?", (face_id,))
+            else:
+                self._conn.execute(
+                    "UPDATE outbox SET status = 'dead' WHERE face_id = ?",
+                    (face_id,),
+                )
+        with self._state:
+            self._depth -= 1
+            if outcome == "dead":
+                self._dead += 1
+                SPOOL_DEAD.set(self._dead)
+            SPOOL_DEPTH.set(self._depth)
+            self._state.notify_all()
+
+    # ======================
+    # Status / shutdown
+    # ======================
+
+    def status(self):
+        return {
+            "encoder_url": self.encoder_url,
+            "pending": self._depth,
+            "in_flight": len(self._in_flight),
+            "dead": self._dead,
+            "high_water": self.high_water,
+            "low_water": self.low_water,
+            "max_attempts": self.max_attempts,
+        }
+
+    def wait_until_empty(self, timeout=None):
+        """Block until every queued face has been delivered or rejected."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._state:
+            while self._depth or self._pending:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._state.wait(min(remaining or 1.0, 1.0))
+        return True
+
+    def close(self):
+        self._stop.set()
+        with self._flush_cond:
+            self._flush_cond.notify_all()
+        with self._state:
+            self._state.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=SEND_TIMEOUT)
+        self._client.close()
+        with self._db_lock:
+            self._conn.close()
+
+
+_default_spool = None
+_default_spool_lock = threading.Lock()
+
+
+def get_spool():
+    """Process-wide spool shared by every capture run."""
+    global _default_spool
+    with _default_spool_lock:
+        if _default_spool is None:
+            _default_spool = FaceSpool()
+        return _default_spool
@@ -0,0 +1,246 @@
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import cv2
+
+from face_capture import FaceAnalyzer, StableFaceSaver
+from stage_metrics import StageMetrics, new_trace_id
+
+STREAM_WORKERS = int(os.getenv("STREAM_WORKERS", 2))  # shared detector/mesh workers
+MAX_PENDING_FRAMES = 2  # per stream; older frames are dropped when workers fall behind
+
+metrics = StageMetrics("face-extract-api")
+
+
+def log(msg):
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {msg}", flush=True)
+
+
+def parse_source(source):
+    """Camera index for digit strings ("0"), otherwise a file path or stream URL."""
+    return int(source) if str(source).isdigit() else source
+
+
+class Stream:
+    """One live source: a reader thread filling a small frame buffer, plus
+    the stream's own streak state and counters."""
+
+    def __init__(self, name, source, saver, realtime, on_frame):
+        self.name = name
+        self.source = source
+        self.saver = saver
+        self.realtime = realtime
+        self.state = "starting"
+        self.error = None
+        self.frames_read = 0
+        self.frames_processed = 0
+        self.frames_dropped = 0
+        self.last_latency = None
+        self.busy = False  # a worker owns this stream's next frame
+        self.frames = deque()  # (frame, rgb frame, stream time, read at)
+        self._on_frame = on_frame
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._read_loop, name=f"stream-{name}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def _read_loop(self):
+        cap = cv2.VideoCapture(parse_source(self.source))
+        if not cap.isOpened():
+            self.state, self.error = "error", f"Cannot open source {self.source}"
+            log(f"❌ Stream {self.name}: {self.error}")
+            return
+
+        is_file = isinstance(parse_source(self.source), str) and os.path.exists(self.source)
+        fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+        started = time.time()
+        self.state = "running"
+        log(f"🎥 Stream {self.name} started: {self.source}")
+        try:
+            while not self._stop.is_set():
+                with metrics.stage("frame_decode"):
+                    success, image = cap.read()
+                    if success:
+                        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+                if not success:
+                    self.state = "finished"
+                    break
+
+                now = time.time()
+                if is_file:
+                    stream_time = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+                    # Play files at their own frame rate so they behave like cameras
+                    if self.realtime:
+                        delay = started + self.frames_read / fps - now
+                        if delay > 0:
+                            time.sleep(delay)
+                else:
+                    stream_time = now
+
+                self.frames_read += 1
+                self._on_frame(self, (image, rgb_image, stream_time, time.time()))
+        finally:
+            cap.release()
+            if self.state == "running":
+                self.state = "stopped"
+            log(f"⏹️ Stream {self.name} {self.state} after {self.frames_read} frames")
+
+    def status(self):
+        return {
+            "name": self.name,
+            "source": str(self.source),
+            "state": self.state,
+            "error": self.error,
+            "frames_read": self.frames_read,
+            "frames_processed": self.frames_processed,
+            "frames_dropped": self.frames_dropped,
+            "faces_saved": self.saver.img_count,
+            "last_latency_ms": None if self.last_latency is None else self.last_latency * 1000,
+            "trace_id": self.saver.trace_id,
+        }
+
+
+class StreamSupervisor:
+    """Runs many sources on a shared pool of detector/mesh workers.
+
+    Readers never block on inference: each stream keeps at most
+    MAX_PENDING_FRAMES frames and drops the oldest when full, and a worker
+    always takes a stream's newest frame, so latency stays bounded. Workers
+    pick streams round-robin, and a stream is only processed by one worker
+    at a time, which keeps its streak state consistent.
+    """
+
+    def __init__(self, spool, image_dir, workers=STREAM_WORKERS,
+                 stable_sec=1.25, **analyzer_kwargs):
+        self.spool = spool
+        self.image_dir = image_dir
+        self.stable_sec = stable_sec
+        self.analyzer_kwargs = analyzer_kwargs
+        self._streams = {}
+        self._order = []  # round-robin order of stream names
+        self._next = 0
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._workers = [
+            threading.Thread(target=self._work_loop, name=f"stream-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    # ======================
+    # Control
+    # ======================
+
+    def start_stream(self, name, source, realtime=True):
+        with self._cond:
+            existing = self._streams.get(name)
+            if existing is not None and existing.state in ("starting", "running"):
+                raise ValueError(f"Stream '{name}' is already running")
+            if existing is not None:
+                # A worker may still be saving the old stream's last frame;
+                # wait for it so the new saver cannot reuse that face's number
+                while existing.busy:
+                    self._cond.wait(0.5)
+            saver = StableFaceSaver(name, self.image_dir, self.stable_sec,
+                                    self.spool, new_trace_id())
+            if existing is not None:
+                saver.img_count = existing.saver.img_count  # keep file names unique on restart
+            stream = Stream(name, source, saver, realtime, self._on_frame)
+            self._streams[name] = stream
+            if name not in self._order:
+                self._order.append(name)
+        stream.start()
+        return stream.status()
+
+    def stop_stream(self, name):
+        with self._cond:
+            stream = self._streams.get(name)
+        if stream is None:
+            raise KeyError(name)
+        stream.stop()
+        stream.join(timeout=5)
+        return stream.status()
+
+    def status(self):
+        with self._cond:
+            streams = list(self._streams.values())
+        return {
+            "workers": len(self._workers),
+            "streams": [stream.status() for stream in streams],
+        }
+
+    def close(self):
+        with self._cond:
+            streams = list(self._streams.values())
+        for stream in streams:
+            stream.stop()
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        for thread in self._workers:
+            thread.join(timeout=5)
+
+    # ======================
+    # Scheduling
+    # ======================
+
+    def _on_frame(self, stream, frame):
+        with self._cond:
+            stream.frames.append(frame)
+            while len(stream.frames) > MAX_PENDING_FRAMES:
+                stream.frames.popleft()
+                stream.frames_dropped += 1
+            self._cond.notify()
+
+    def _next_job(self):
+        """Newest frame of the next idle stream in round-robin order (call with the lock)."""
+        for offset in range(len(self._order)):
+            index = (self._next + offset) % len(self._order)
+            stream = self._streams[self._order[index]]
+            if stream.busy or not stream.frames:
+                continue
+            self._next = index + 1
+            frame = stream.frames.pop()
+            stream.frames_dropped += len(stream.frames)
+            stream.frames.clear()
+            stream.busy = True
+            return stream, frame
+        return None, None
+
+    def _work_loop(self):
+        analyzer = FaceAnalyzer(static_image_mode=True, **self.analyzer_kwargs)
+        try:
+            while not self._stop.is_set():
+                # Backpressure: do not produce faces while the encoder is behind
+                self.spool.wait_for_capacity()
+                with self._cond:
+                    stream, frame = self._next_job()
+                    if stream is None:
+                        self._cond.wait(0.5)
+                        continue
+
+                image, rgb_image, stream_time, read_at = frame
+                try:
+                    face_roi = analyzer.find_valid_face(image, rgb_image)
+                    stream.saver.update(face_roi, stream_time)
+                except Exception as e:
+                    log(f"⚠️ Stream {stream.name}: frame failed: {e}")
+                finally:
+                    stream.last_latency = time.time() - read_at
+                    stream.frames_processed += 1
+                    with self._cond:
+                        stream.busy = False
+                        self._cond.notify_all()  # idle workers and a pending restart
+        finally:
+            analyzer.close()
@@ -0,0 +1,407 @@
+"""Offline benchmark suite for the three face services.
+
+Runs entirely on localhost with no GPU and no downloads:
+
+* capture  - capture_stable_faces on a synthetic video, sending to a stub encoder
+* encode   - load test of POST /encode (DeepFace replaced by synthetic embeddings)
+* cluster  - GET /cluster_video_faces over N synthetic embeddings
+
+Every case runs in a fresh process so peak RSS is per case. Results are
+printed (and optionally written) as JSON so branches can be compared:
+
+    python benchmark_suite.py --cases capture,encode,cluster \
+        --encode-scales 100,1000 --cluster-scales 100,1000,10000 --output bench.json
+
+Scales up to 1000000 are accepted; cases that exceed --timeout are reported
+as "timeout" rather than aborting the run.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import multiprocessing as mp
+import os
+import platform
+import queue
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import types
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+import synthetic_media  # noqa: E402
+
+EXTRACT_DIR = os.path.join(synthetic_media.REPO_DIR, "Docker - Face extracting")
+ENCODE_DIR = os.path.join(synthetic_media.REPO_DIR, "Docker - Face encoding")
+ANALYSIS_DIR = os.path.join(synthetic_media.REPO_DIR, "Docker - Face analysis service")
+
+# Keep every HTTP client on loopback even if a proxy is configured
+os.environ["NO_PROXY"] = os.environ["no_proxy"] = "127.0.0.1,localhost"
+
+
+# ======================
+# Helpers
+# ======================
+
+def percentiles(samples):
+    if not samples:
+        return {"p50_ms": None, "p99_ms": None, "mean_ms": None}
+    values = np.asarray(samples) * 1000
+    return {
+        "p50_ms": float(np.percentile(values, 50)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "mean_ms": float(values.mean()),
+    }
+
+
+def stage_summary():
+    """Per-stage count, mean and histogram-bucket p50/p99 upper bounds."""
+    from stage_metrics import STAGE_SECONDS
+
+    stages = {}
+    for metric in STAGE_SECONDS.collect():
+        for sample in metric.samples:
+            stage = stages.setdefault(sample.labels["stage"], {"buckets": []})
+            if sample.name.endswith("_bucket"):
+                stage["buckets"].append((float(sample.labels["le"]), sample.value))
+            elif sample.name.endswith("_sum"):
+                stage["sum"] = sample.value
+            elif sample.name.endswith("_count"):
+                stage["count"] = sample.value
+
+    summary = {}
+    for name, stage in stages.items():
+        count = stage.get("count", 0)
+        if not count:
+            continue
+        buckets = sorted(stage["buckets"])
+
+        def upper_bound(q):
+            for le, cumulative in buckets:
+                if cumulative >= q * count:
+                    return le * 1000
+            return None
+
+        summary[name] = {
+            "count": int(count),
+            "mean_ms": stage["sum"] / count * 1000,
+            "p50_le_ms": upper_bound(0.50),
+            "p99_le_ms": upper_bound(0.99),
+        }
+    return summary
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    return sock
+
+
+class LocalServer:
+    """Runs a FastAPI app with uvicorn on a loopback port in a background thread."""
+
+    def __init__(self, app):
+        import uvicorn
+
+        self._sock = free_port()
+        self.port = self._sock.getsockname()[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+        self._thread = threading.Thread(
+            target=self._server.run, kwargs={"sockets": [self._sock]}, daemon=True
+        )
+
+    def __enter__(self):
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self._server.should_exit = True
+        self._thread.join(timeout=10)
+
+
+class StubEncoder:
+    """Minimal /encode stand-in that accepts every upload and counts it."""
+
+    def __init__(self):
+        stub = self
+        self.received = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with stub._lock:
+                    stub.received += 1
+                    stub.bytes += len(body)
+                payload = b'{"status": "embedding created"}'
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}/encode"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+
+
+# ======================
+# Cases (each runs in its own process)
+# ======================
+
+def bench_capture(work_dir, seconds_per_face=3.0):
+    os.environ["SPOOL_DIR"] = os.path.join(work_dir, "spool")
+    sys.path.insert(0, EXTRACT_DIR)
+    from face_capture import capture_stable_faces
+    from face_spool import FaceSpool
+
+    video_path = os.path.join(work_dir, "synthetic.mp4")
+    frames = synthetic_media.write_synthetic_video(video_path, seconds_per_face=seconds_per_face)
+    image_dir = os.path.join(work_dir, "faces")
+
+    with StubEncoder() as stub:
+        spool = FaceSpool(encoder_url=stub.url)
+        start = time.perf_counter()
+        capture_stable_faces(
+            use_camera=False,
+            video_path=video_path,
+            image_dir=image_dir,
+            spool=spool,
+        )
+        elapsed = time.perf_counter() - start
+
+        # Uploads are drained from the spool in the background
+        saved = len(os.listdir(image_dir)) if os.path.isdir(image_dir) else 0
+        spool.wait_until_empty(timeout=30)
+        received = stub.received
+        spool_status = spool.status()
+        spool.close()
+
+    return {
+        "frames": frames,
+        "elapsed_s": elapsed,
+        "fps": frames / elapsed,
+        "faces_saved": saved,
+        "faces_received_by_encoder": received,
+        "spool": spool_status,
+        "stages": stage_summary(),
+    }
+
+
+def bench_encode(work_dir, n, concurrency=8):
+    os.environ["OUTPUT_ENCODE_DIR"] = os.path.join(work_dir, "embeddings")
+    os.environ["OUTPUT_IMAGE_DIR"] = os.path.join(work_dir, "face_images")
+    sys.path.insert(0, ENCODE_DIR)
+    import httpx
+
+    # No model weights offline: DeepFace returns a synthetic 512-d embedding.
+    # The stub module is installed before the service imports it, so neither
+    # deepface nor TensorFlow has to be installed or loaded.
+    rng = np.random.default_rng(0)
+
+    def fake_represent(**kwargs):
+        return [{"embedding": rng.standard_normal(512).tolist()}]
+
+    deepface_stub = types.ModuleType("deepface")
+    deepface_stub.DeepFace = types.SimpleNamespace(represent=fake_represent)
+    sys.modules["deepface"] = deepface_stub
+    import face_encode_api
+
+    with open(synthetic_media.sample_face_paths()[0], "rb") as f:
+        image_bytes = f.read()
+
+    latencies = []
+    failures = 0
+
+    async def run(url):
+        nonlocal failures
+        limit = asyncio.Semaphore(concurrency)
+        async with httpx.AsyncClient(timeout=60) as client:
+            async def one(i):
+                nonlocal failures
+                async with limit:
+                    files = {"file": (f"bench_img{i}.jpg", image_bytes, "image/jpeg")}
+                    start = time.perf_counter()
+                    response = await client.post(url, files=files)
+                    latencies.append(time.perf_counter() - start)
+                    if response.status_code != 200:
+                        failures += 1
+            await asyncio.gather(*(one(i) for i in range(n)))
+
+    with LocalServer(face_encode_api.app) as server:
+        start = time.perf_counter()
+        asyncio.run(run(f"{server.url}/encode"))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "n": n,
+        "concurrency": concurrency,
+        "elapsed_s": elapsed,
+        "throughput_rps": n / elapsed,
+        "failures": failures,
+        **percentiles(latencies),
+        "stages": stage_summary(),
+    }
+
+
+def bench_cluster(work_dir, n, repeat=3, threshold=0.3):
+    embeddings_dir = os.path.join(work_dir, "embeddings")
+    images_dir = os.path.join(work_dir, "face_images")
+    synthetic_media.write_embeddings(
+        embeddings_dir, images_dir, "benchvid", synthetic_media.synthetic_embeddings(n)
+    )
+
+    sys.path.insert(0, ANALYSIS_DIR)
+    import httpx
+    import face_analysis_api
+
+    face_analysis_api.EMBEDDINGS_FOLDER = embeddings_dir
+    face_analysis_api.IMAGES_FOLDER = images_dir
+
+    latencies = []
+    with LocalServer(face_analysis_api.app) as server, httpx.Client(timeout=None) as client:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = client.get(
+                f"{server.url}/cluster_video_faces",
+                params={"video_name": "benchvid", "threshold": threshold},
+            )
+            latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+        num_persons = response.json()["num_persons"]
+
+    stats = percentiles(latencies)
+    return {
+        "n": n,
+        "repeat": repeat,
+        "num_persons": num_persons,
+        "throughput_faces_per_s": n / (stats["p50_ms"] / 1000),
+        **stats,
+        "stages": stage_summary(),
+    }
+
+
+CASES = {"capture": bench_capture, "encode": bench_encode, "cluster": bench_cluster}
+
+
+# ======================
+# Runner
+# ======================
+
+def _child(func, kwargs, results):
+    # Service log lines go to stderr so stdout stays valid JSON
+    with tempfile.TemporaryDirectory(prefix="face-bench-") as work_dir, \
+            contextlib.redirect_stdout(sys.stderr):
+        try:
+            result = {"status": "ok", **func(work_dir, **kwargs)}
+        except Exception as e:
+            result = {"status": "error", "error": str(e), "traceback": traceback.format_exc()}
+    result["peak_rss_mb"] = peak_rss_mb()
+    results.put(result)
+
+
+def run_isolated(case, kwargs, timeout):
+    ctx = mp.get_context("spawn")
+    results = ctx.Queue()
+    proc = ctx.Process(target=_child, args=(CASES[case], kwargs, results))
+    start = time.perf_counter()
+    proc.start()
+    try:
+        result = results.get(timeout=timeout)
+    except queue.Empty:
+        proc.terminate()
+        result = {"status": "timeout", "timeout_s": timeout}
+    proc.join()
+    return {"case": case, **kwargs, "wall_s": time.perf_counter() - start, **result}
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=HERE, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def parse_scales(value):
+    return [int(float(v)) for v in value.split(",") if v]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cases", default="capture,encode,cluster")
+    parser.add_argument("--encode-scales", type=parse_scales, default=[100, 1000])
+    parser.add_argument("--cluster-scales", type=parse_scales, default=[100, 1000])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=600, help="seconds per case")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    plan = []
+    for case in args.cases.split(","):
+        if case == "capture":
+            plan.append((case, {}))
+        elif case == "encode":
+            plan += [(case, {"n": n, "concurrency": args.concurrency}) for n in args.encode_scales]
+        elif case == "cluster":
+            plan += [(case, {"n": n, "repeat": args.repeat}) for n in args.cluster_scales]
+        else:
+            parser.error(f"unknown case {case!r}; choose from {', '.join(CASES)}")
+
+    results = []
+    for case, kwargs in plan:
+        print(f"⏱️ Running {case} {kwargs}", file=sys.stderr, flush=True)
+        results.append(run_isolated(case, kwargs, args.timeout))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k != "output"},
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,4 +3,5 @@ docker run -d \
   -p 8000:8000 \
   --env-file .env \
   -v /home/bngl1/projects/cs5939/container_output:/app/face_image:Z \
+  -v /home/bngl1/projects/cs5939/extract_spool:/app/spool:Z \
   tutubinbin/face-extract-api:latest
@@ -0,0 +1,186 @@
+"""Single-node, in-process run of the face pipeline for offline archives.
+
+Chains the same code the three services run - capture_stable_faces detection,
+the encoder's DeepFace call and the analysis service's clustering - as
+generator stages in one process. Face crops and embeddings stay in memory, so
+there is no HTTP round trip, JPEG re-encode or file write per face, and each
+video's clusters come out as soon as its last face is encoded:
+
+    python inprocess_pipeline.py video1.mp4 video2.mp4 --output-dir out
+
+With --output-dir the faces are also written the way the encoder stores them
+(<output-dir>/face_images/<video>_img<n>.jpg and <output-dir>/embeddings/...npy),
+so the analysis service can serve the result later.
+"""
+import argparse
+import contextlib
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+import cv2
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(HERE)
+EXTRACT_DIR = os.path.join(REPO_DIR, "Docker - Face extracting")
+ENCODE_DIR = os.path.join(REPO_DIR, "Docker - Face encoding")
+ANALYSIS_DIR = os.path.join(REPO_DIR, "Docker - Face analysis service")
+for service_dir in (EXTRACT_DIR, ENCODE_DIR, ANALYSIS_DIR):
+    if service_dir not in sys.path:
+        sys.path.insert(0, service_dir)
+
+from face_analysis_api import cluster_embeddings  # noqa: E402
+from face_capture import iter_stable_faces, video_name_for  # noqa: E402
+from face_encode_api import compute_embedding, face_paths, store_face  # noqa: E402
+
+PREFETCH = 16  # detected faces buffered ahead of the encoder
+
+_END = object()
+
+
+# ======================
+# Stages
+# ======================
+
+def extract_faces(video_path, **capture_kwargs):
+    """Yield (name, face crop) for each stable face, named like the extractor does."""
+    video_name = video_name_for(video_path)
+    faces = iter_stable_faces(use_camera=False, video_path=video_path, **capture_kwargs)
+    for i, face_roi in enumerate(faces):
+        yield f"{video_name}_img{i}", face_roi
+
+
+def prefetch(items, size=PREFETCH):
+    """Run an iterator in a background thread, `size` items ahead of its consumer.
+
+    Lets detection of the next frames overlap with DeepFace inference; the
+    bounded queue stops detection from racing ahead of the encoder.
+    """
+    buffer = queue.Queue(maxsize=max(1, size))
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in items:
+                if stop.is_set():
+                    return
+                buffer.put(item)
+        except BaseException as e:
+            buffer.put(e)
+        else:
+            buffer.put(_END)
+
+    thread = threading.Thread(target=produce, name="pipeline-prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        while thread.is_alive():
+            # Unblock a producer waiting on a full queue
+            try:
+                buffer.get_nowait()
+            except queue.Empty:
+                thread.join(0.1)
+
+
+def encode_faces(faces):
+    """Yield (name, face crop, embedding) using the encoder's DeepFace call."""
+    for name, face_roi in faces:
+        yield name, face_roi, compute_embedding(face_roi)
+
+
+def persist_faces(encoded, output_dir):
+    """Write each face in the encoder's directory layout and pass it through."""
+    emb_dir = os.path.join(output_dir, "embeddings")
+    img_dir = os.path.join(output_dir, "face_images")
+    os.makedirs(emb_dir, exist_ok=True)
+    os.makedirs(img_dir, exist_ok=True)
+    for name, face_roi, emb in encoded:
+        success, buffer = cv2.imencode(".jpg", face_roi)
+        if not success:
+            raise RuntimeError(f"Failed to encode {name} as JPEG")
+        emb_path, img_path = face_paths(f"{name}.jpg", emb_dir, img_dir)
+        store_face(emb_path, img_path, emb, buffer.tobytes())
+        yield name, face_roi, emb
+
+
+# ======================
+# Pipeline
+# ======================
+
+def run_video(video_path, threshold=0.3, output_dir=None, prefetch_size=PREFETCH, **capture_kwargs):
+    """Detect, encode and cluster one video; returns the analysis-style result."""
+    started = time.time()
+    faces = prefetch(extract_faces(video_path, **capture_kwargs), prefetch_size)
+    encoded = encode_faces(faces)
+    if output_dir:
+        encoded = persist_faces(encoded, output_dir)
+
+    embeddings = {name: emb for name, _, emb in encoded}
+    groups = cluster_embeddings(embeddings, threshold)
+    elapsed = time.time() - started
+
+    return {
+        "video_name": video_name_for(video_path),
+        "threshold": threshold,
+        "num_faces": len(embeddings),
+        "num_persons": len(groups),
+        "groups": [
+            {"person_id": i, "faces": group}
+            for i, group in enumerate(groups, 1)
+        ],
+        "seconds": elapsed,
+        "faces_per_sec": len(embeddings) / elapsed if elapsed > 0 else None,
+    }
+
+
+def run_pipeline(video_paths, threshold=0.3, output_dir=None, prefetch_size=PREFETCH, **capture_kwargs):
+    """Run every video in turn; yields one result per video as it finishes."""
+    for video_path in video_paths:
+        yield run_video(video_path, threshold, output_dir, prefetch_size, **capture_kwargs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("videos", nargs="+", help="video files to process")
+    parser.add_argument("--threshold", type=float, default=0.3, help="cosine distance for one person")
+    parser.add_argument("--output-dir", help="also store faces and embeddings under this folder")
+    parser.add_argument("--stable-sec", type=float, default=1.25)
+    parser.add_argument("--min-detection-confidence", type=float, default=0.9)
+    parser.add_argument("--max-num-faces", type=int, default=1)
+    parser.add_argument("--prefetch", type=int, default=PREFETCH)
+    args = parser.parse_args(argv)
+
+    # Keep stdout for the JSON results; service log lines go to stderr
+    out = sys.stdout
+    total_faces, started = 0, time.time()
+    with contextlib.redirect_stdout(sys.stderr):
+        for result in run_pipeline(
+            args.videos,
+            threshold=args.threshold,
+            output_dir=args.output_dir,
+            prefetch_size=args.prefetch,
+            stable_sec=args.stable_sec,
+            min_detection_confidence=args.min_detection_confidence,
+            max_num_faces=args.max_num_faces,
+        ):
+            total_faces += result["num_faces"]
+            print(json.dumps(result), file=out, flush=True)
+
+    elapsed = time.time() - started
+    print(f"{total_faces} faces from {len(args.videos)} video(s) in {elapsed:.1f}s "
+          f"({total_faces / elapsed:.1f} faces/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
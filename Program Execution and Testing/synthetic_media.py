@@ -0,0 +1,113 @@
+"""Synthetic inputs for the offline benchmark suite.
+
+Videos are built from the bundled face samples composited onto generated
+backgrounds, and embeddings are drawn around random identity centres, so
+nothing has to be downloaded.
+"""
+import glob
+import os
+
+import cv2
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_FACE_DIRS = [
+    os.path.join(REPO_DIR, "Docker - Face extracting", "face_image"),
+    os.path.join(REPO_DIR, "Docker - Face encoding", "face_images"),
+]
+
+
+def sample_face_paths():
+    paths = []
+    for folder in SAMPLE_FACE_DIRS:
+        paths.extend(sorted(glob.glob(os.path.join(folder, "*.jpg"))))
+    if not paths:
+        raise FileNotFoundError(f"No sample faces found in {SAMPLE_FACE_DIRS}")
+    return paths
+
+
+def make_background(width, height, rng):
+    """Smooth colour gradient with a few random rectangles as clutter."""
+    top = rng.integers(40, 200, size=3)
+    bottom = rng.integers(40, 200, size=3)
+    ramp = np.linspace(0.0, 1.0, height)[:, None, None]
+    background = (top * (1 - ramp) + bottom * ramp).astype(np.uint8)
+    background = np.repeat(background, width, axis=1)
+    for _ in range(6):
+        x, y = rng.integers(0, width), rng.integers(0, height)
+        w, h = rng.integers(20, width // 3), rng.integers(20, height // 3)
+        color = tuple(int(c) for c in rng.integers(0, 255, size=3))
+        cv2.rectangle(background, (int(x), int(y)), (int(x + w), int(y + h)), color, -1)
+    return background
+
+
+def write_synthetic_video(path, width=640, height=480, fps=25, seconds_per_face=3.0,
+                          gap_seconds=0.5, face_height=240, seed=0):
+    """Write an mp4 where each sample face drifts slowly across its own background.
+
+    A short empty gap between faces ends the previous stability streak, so each
+    face can be saved once. Returns the number of frames written.
+    """
+    rng = np.random.default_rng(seed)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    if not writer.isOpened():
+        raise RuntimeError(f"Cannot open video writer for {path}")
+
+    frames = 0
+    try:
+        for face_path in sample_face_paths():
+            face = cv2.imread(face_path)
+            scale = face_height / face.shape[0]
+            face = cv2.resize(face, (max(1, int(face.shape[1] * scale)), face_height))
+            fh, fw = face.shape[:2]
+            background = make_background(width, height, rng)
+
+            x = float(rng.integers(0, max(1, width - fw)))
+            y = float(rng.integers(0, max(1, height - fh)))
+            vx, vy = rng.uniform(-1.5, 1.5, size=2)
+            for _ in range(int(seconds_per_face * fps)):
+                frame = background.copy()
+                x = min(max(x + vx, 0), width - fw)
+                y = min(max(y + vy, 0), height - fh)
+                frame[int(y):int(y) + fh, int(x):int(x) + fw] = face
+                writer.write(frame)
+                frames += 1
+
+            for _ in range(int(gap_seconds * fps)):
+                writer.write(background)
+                frames += 1
+    finally:
+        writer.release()
+    return frames
+
+
+def synthetic_embeddings(n, dim=512, faces_per_person=10, noise=0.3, seed=0):
+    """`n` embeddings in groups of `faces_per_person` around random identity centres.
+
+    `noise` is the norm of the per-face perturbation of a unit centre, which
+    keeps same-person cosine distances well under the default 0.3 threshold.
+    """
+    rng = np.random.default_rng(seed)
+    persons = max(1, n // faces_per_person)
+    centres = rng.standard_normal((persons, dim))
+    centres /= np.linalg.norm(centres, axis=1, keepdims=True)
+    person_of = np.arange(n) % persons
+    perturbation = rng.standard_normal((n, dim)) * (noise / np.sqrt(dim))
+    return centres[person_of] + perturbation
+
+
+def write_embeddings(embeddings_dir, images_dir, video_name, embeddings):
+    """Lay out embeddings (and one hard-linked sample image per face) the way
+    the encoder writes them, so the analysis service can read them."""
+    os.makedirs(embeddings_dir, exist_ok=True)
+    os.makedirs(images_dir, exist_ok=True)
+    sample_image = sample_face_paths()[0]
+    for i, emb in enumerate(embeddings):
+        name = f"{video_name}_img{i}"
+        np.save(os.path.join(embeddings_dir, f"{name}.npy"), emb)
+        image_path = os.path.join(images_dir, f"{name}.jpg")
+        try:
+            os.link(sample_image, image_path)
+        except OSError:
+            with open(sample_image, "rb") as src, open(image_path, "wb") as dst:
+                dst.write(src.read())